@@ -1,5 +1,10 @@
+import importlib
+import os
+import time
+from datetime import datetime
+
+from app.ErrorLog import ErrorLog
 from app.OutputWriter import OutputWriter
-from app.PDFExtractor import PDFExtractor
 from app.RecordProcessor import RecordProcessor
 from app.Validator import Validator
 from app.SQLiteWriter import SQLiteWriter
@@ -10,28 +15,63 @@ class App:
     Coordinates the flow of the application
 
     Steps:
-        1. Extracts records from a PDF
+        1. Extracts records from a PDF, CSV or Excel file
         2. Validate each record
         3. Write valid records to a csv file
         4. Write an error report
+        5. Save the valid records and the run statistics to SQLite
     """
-    def __init__(self, inputPDF, outputDirectory):
+    # Input source for each supported file extension, as (module, class)
+    # Only the source for the file being processed is imported
+    SOURCES = {
+        ".pdf": ("app.PDFExtractor", "PDFExtractor"),
+        ".csv": ("app.CSVExtractor", "CSVExtractor"),
+        ".xlsx": ("app.ExcelExtractor", "ExcelExtractor"),
+        ".xlsm": ("app.ExcelExtractor", "ExcelExtractor"),
+    }
+
+    # Records per batch queued on a shared BatchWriter
+    SUBMIT_BATCH_SIZE = 1000
+
+    def __init__(self, inputFile, outputDirectory, upsert=False, columnarFormat=None, preflight=True,
+                 isolated=False, pageTimeout=60, isolationWorkers=1, compressErrors=False, batchWriter=None,
+                 detectDuplicates=True, validationWorkers=1):
         """
         Creates the components of the application
 
-        :param inputPDF: Path to the PDF containing the records
+        :param inputFile: Path to the PDF, CSV or Excel file containing the records
         :param outputDirectory: Directory where the output files will be written
+        :param upsert: Only write new or changed records to the database instead of replacing every row
+        :param columnarFormat: Also write the valid records to a columnar file. One of auto, parquet, arrow or npz
+        :param preflight: Skip table extraction on pages that can't contain a table
+        :param isolated: Extract each page in a child process so a page that hangs or crashes only loses that page
+        :param pageTimeout: Seconds each page is given in isolated mode
+        :param isolationWorkers: Number of child processes extracting pages at once in isolated mode
+        :param compressErrors: gzip the machine readable error log
+        :param batchWriter: A running BatchWriter for a database shared with other runs.
+            Valid records are queued on it instead of being written to records.db in the output directory
+        :param detectDuplicates: Flag records that repeat a health card number or claim, in the run or in the database
+        :param validationWorkers: Number of threads validating records
         """
 
-        # Extracts rows from the PDF
-        self.extractor = PDFExtractor(inputPDF)
+        # Extracts rows from the input file
+        extension = os.path.splitext(inputFile)[1].lower()
+        if extension not in self.SOURCES:
+            raise Exception(
+                f"The file '{inputFile}' is not a supported type\n"
+                f"Supported types are {', '.join(self.SOURCES)}")
+
+        moduleName, className = self.SOURCES[extension]
+        sourceClass = getattr(importlib.import_module(moduleName), className)
+
+        if extension == ".pdf":
+            self.extractor = sourceClass(inputFile, preflight, isolated, pageTimeout, workers=isolationWorkers)
+        else:
+            self.extractor = sourceClass(inputFile)
 
         # Validates the records
         self.validator = Validator()
 
-        # Runs the components that extract and validate
-        self.processor = RecordProcessor(self.extractor, self.validator)
-
         # Writes CSV and text report
         self.outputWriter = None
 
@@ -39,16 +79,45 @@ class App:
         self.outDirectory = outputDirectory
 
         # SQLite writer
-        dbPath = f"{self.outDirectory}/records.db"
-        self.dbWriter = SQLiteWriter(dbPath)
+        self.batchWriter = batchWriter
+        if batchWriter is not None:
+            self.dbWriter = batchWriter.dbWriter
+        else:
+            dbPath = f"{self.outDirectory}/records.db"
+            self.dbWriter = SQLiteWriter(dbPath)
+        self.upsert = upsert
+
+        # Flags repeated health card numbers and claims, within the run and against earlier runs in the database
+        self.duplicateDetector = None
+        if detectDuplicates:
+            from app.DuplicateDetector import DuplicateDetector
+            self.duplicateDetector = DuplicateDetector(self.dbWriter.dbPath)
+
+        # Runs the components that extract and validate
+        self.processor = RecordProcessor(self.extractor, self.validator, self.duplicateDetector,
+                                         workers=validationWorkers)
+
+        # Rows inserted, updated and unchanged by the last upsert
+        self.dbStats = None
+
+        # Machine readable log of the invalid records
+        self.errorLog = ErrorLog(f"{self.outDirectory}/error_records.jsonl", compressErrors)
+
+        # Columnar export of the valid records, auto picks the best installed format
+        self.columnarFormat = columnarFormat
+        self.columnarPath = None
 
     def run(self):
         """
         Runs the extraction and validation process
         Generates the output files
         """
+        startedAt = datetime.now()
+
         # Run the extraction and validation
+        processingStarted = time.perf_counter()
         self.processor.process()
+        processingSeconds = time.perf_counter() - processingStarted
 
         # Paths for the output files
         validPath = f"{self.outDirectory}/valid_records.csv"
@@ -56,17 +125,95 @@ class App:
         jsonPath = f"{self.outDirectory}/statistics.json"
 
         # Writing the CSV, error report, and statistics
-        self.outputWriter = OutputWriter(self.processor.validRecords, self.processor.invalidRecords)
+        self.outputWriter = OutputWriter(self.processor.validRecords, self.processor.invalidRecords,
+                                         self.extractor.pageStats)
         self.outputWriter.writeValidCSV(validPath)
         self.outputWriter.writeErrorReport(invalidPath)
         self.outputWriter.writeJSON(jsonPath)
+        self.errorLog.write(self.processor.invalidRecords)
+
+        # Statistics saved to the run history tables
+        runStats = (
+            self.extractor.filePath,
+            startedAt,
+            datetime.now(),
+            processingSeconds,
+            self.outputWriter.totalRecords,
+            len(self.processor.validRecords),
+            len(self.processor.invalidRecords),
+            self.outputWriter.ruleStats,
+            self.outputWriter.fieldStats
+        )
+
+        # Write valid records and the run to SQLite
+        if self.batchWriter is not None:
+            self.writeBatches(runStats)
+        else:
+            if self.upsert:
+                self.dbStats = self.dbWriter.upsertRecords(self.processor.validRecords)
+            else:
+                self.dbWriter.insertRecords(self.processor.validRecords)
 
-        # Write valid records to SQLite
-        self.dbWriter.insertRecords(self.processor.validRecords)
+            self.dbWriter.recordRun(*runStats)
+
+        # Writing the columnar copy of the valid records
+        # Done last so a failing optional export can't cost the database its rows
+        if self.columnarFormat is not None:
+            from app.ColumnarWriter import ColumnarWriter
+            fileFormat = None if self.columnarFormat == "auto" else self.columnarFormat
+            columnarWriter = ColumnarWriter(self.processor.validRecords)
+            self.columnarPath = columnarWriter.write(f"{self.outDirectory}/valid_records", fileFormat)
+
+    def writeBatches(self, runStats):
+        """
+        Queues the valid records on the shared BatchWriter, waits until they are committed, then saves the run
+
+        The run is only added to the history once every one of its rows is in the database,
+        so a run whose rows were lost never shows up as a successful run
+
+        :param runStats: The arguments of SQLiteWriter.recordRun
+        :raises Exception: If any of the run's rows could not be written, or the run couldn't be saved
+        """
+        validRecords = self.processor.validRecords
+        futures = []
+
+        for start in range(0, len(validRecords), self.SUBMIT_BATCH_SIZE):
+            futures.append(self.batchWriter.submit(validRecords[start:start + self.SUBMIT_BATCH_SIZE]))
+
+        # Every batch is waited on, so none is still pending when the error is raised
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        error = None
+        for future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+
+            if result is not None:
+                for outcome, count in result.items():
+                    counts[outcome] += count
+
+        if error is not None:
+            raise Exception(
+                f"Records could not be written to '{self.dbWriter.dbPath}', the run was not saved\n"
+                f"Details: {str(error)}")
+
+        try:
+            self.batchWriter.submitRun(*runStats).result()
+        except Exception as e:
+            raise Exception(
+                f"The run could not be saved to '{self.dbWriter.dbPath}'\n"
+                f"Details: {str(e)}")
+
+        if self.batchWriter.upsert:
+            self.dbStats = counts
 
 if __name__ == "__main__":
+    import argparse
     import sys
-    import os
+
+    from app.Metrics import getRegistry
 
     # This allows for debugging properly
     if "PYCHARM_HOSTED" in os.environ:
@@ -79,25 +226,66 @@ if __name__ == "__main__":
             f"{output}"
         ]
 
-    # Expects two arguments
-    if len(sys.argv) != 3:
-        print("Usage: python app.py <input.pdf> <output directory>")
-        sys.exit(1)
+    # Expects the input file and output directory, followed by any options
+    parser = argparse.ArgumentParser(
+        usage="python app.py <input file> <output directory> [options]",
+        description="Extracts and validates patient records")
+    parser.add_argument("inputFile", help="Path to the PDF, CSV or Excel file containing the records")
+    parser.add_argument("outputDirectory", help="Directory where the output files will be written")
+    parser.add_argument("--upsert", action="store_true",
+                        help="Only write new or changed records to the database")
+    parser.add_argument("--columnar", nargs="?", const="auto", choices=["auto", "parquet", "arrow", "npz"],
+                        help="Also write the valid records to a columnar file (default: best installed format)")
+    parser.add_argument("--no-preflight", dest="preflight", action="store_false",
+                        help="Run table extraction on every page instead of skipping pages without a table")
+    parser.add_argument("--isolated", action="store_true",
+                        help="Extract each page in a child process with a time limit")
+    parser.add_argument("--page-timeout", type=float, default=60,
+                        help="Seconds each page is given in isolated mode (default: 60)")
+    parser.add_argument("--isolation-workers", type=int, default=1,
+                        help="Number of pages extracted at once in isolated mode (default: 1)")
+    parser.add_argument("--compress-errors", action="store_true",
+                        help="gzip the machine readable error log")
+    parser.add_argument("--no-duplicate-check", dest="detectDuplicates", action="store_false",
+                        help="Don't flag records that repeat a health card number or claim")
+    parser.add_argument("--validation-workers", type=int, default=1,
+                        help="Number of threads validating records (default: 1)")
+    parser.add_argument("--metrics-file",
+                        help="Add this run's metrics to a Prometheus text format file, creating it if needed")
+    args = parser.parse_args()
 
     # Read command line arguments
-    inputPDF = sys.argv[1]
-    outputDirectory = sys.argv[2]
+    inputFile = args.inputFile
+    outputDirectory = args.outputDirectory
 
     # Creates the output directory if it doesn't exist
     if not os.path.exists(outputDirectory):
         os.makedirs(outputDirectory)
 
+    # Metrics have to be enabled before the components are created
+    if args.metrics_file:
+        getRegistry().enable()
+        getRegistry().loadTextFile(args.metrics_file)
+
     # Create and run the application
     try:
-        app = App(inputPDF, outputDirectory)
+        app = App(inputFile, outputDirectory, upsert=args.upsert, columnarFormat=args.columnar,
+                  preflight=args.preflight, isolated=args.isolated, pageTimeout=args.page_timeout,
+                  isolationWorkers=args.isolation_workers, compressErrors=args.compress_errors,
+                  detectDuplicates=args.detectDuplicates, validationWorkers=args.validation_workers)
         app.run()
     except Exception as e:
         print(str(e))
         exit(1)
+    finally:
+        if args.metrics_file:
+            getRegistry().writeTextFile(args.metrics_file)
+
+    if app.dbStats is not None:
+        print(f"Database: {app.dbStats['inserted']} inserted, {app.dbStats['updated']} updated, "
+              f"{app.dbStats['unchanged']} unchanged")
+
+    if app.columnarPath is not None:
+        print(f"Columnar output: {app.columnarPath}")
 
     print("Done.")
\ No newline at end of file
@@ -1,23 +1,61 @@
 import streamlit as st
-import pandas as pd
 import os
+import shutil
 import tempfile
 import json
-import plotly.express as px
+import threading
+import time
 
 from App import App
 from app.Fields import Fields
+from app.SQLiteWriter import SQLiteWriter
 
 
-def displayValidRecords(output):
-    """Display the valid records content"""
+def displayValidRecords(output, source, pageSize=100):
+    """Display the valid records content one page at a time"""
+    # pandas is only loaded once there is something to display
+    import pandas as pd
+
     st.subheader("Valid Records")
     csvPath = os.path.join(output, "valid_records.csv")
+    dbPath = os.path.join(output, "records.db")
+
+    if os.path.exists(csvPath) and os.path.exists(dbPath):
+        dbWriter = SQLiteWriter(dbPath)
+        total = dbWriter.countRecords()
+
+        # Start from the first page whenever a different file is uploaded
+        if st.session_state.get("validRecordsSource") != source:
+            st.session_state["validRecordsSource"] = source
+            st.session_state["validRecordsPage"] = 0
+            st.session_state["validRecordsKeys"] = [None]
+
+        # The patient id each visited page starts after, so pages are fetched by key instead of offset
+        page = st.session_state["validRecordsPage"]
+        keys = st.session_state["validRecordsKeys"]
 
-    if os.path.exists(csvPath):
-        df = pd.read_csv(csvPath)
+        rows = dbWriter.queryRecords(afterPatientId=keys[page], limit=pageSize)
+        df = pd.DataFrame(rows, columns=[Fields.getDisplayName(column.lower()) for column in SQLiteWriter.COLUMNS])
         st.dataframe(df, use_container_width=True, hide_index=True)
 
+        pageCount = max(1, -(-total // pageSize))
+        col1, col2, col3 = st.columns([1, 1, 6])
+
+        with col1:
+            if st.button("Previous", disabled=page == 0):
+                st.session_state["validRecordsPage"] = page - 1
+                st.rerun()
+
+        with col2:
+            if st.button("Next", disabled=page + 1 >= pageCount or not rows):
+                if len(keys) == page + 1:
+                    keys.append(rows[-1][0])
+                st.session_state["validRecordsPage"] = page + 1
+                st.rerun()
+
+        with col3:
+            st.caption(f"Page {page + 1} of {pageCount} ({total} records)")
+
         with open(csvPath, "rb") as f:
             st.download_button(
                 label="Download Valid Records (CSV file)",
@@ -51,6 +89,10 @@ def displayReport(output):
 
 def displayStatistics(output):
     """Display the statistics content"""
+    # pandas and plotly are only loaded once there is something to display
+    import pandas as pd
+    import plotly.express as px
+
     st.subheader("Statistics")
     jsonPath = os.path.join(output, "statistics.json")
 
@@ -126,14 +168,100 @@ def displayStatistics(output):
     else:
         st.warning("No statistics found")
 
-def run(inputPDF, outputDirectory):
-    """Run the app"""
-    try:
-        with st.spinner("Processing PDF..."):
-            app = App(inputPDF, outputDirectory)
+def displayProgress(placeholder, validCount, invalidCount, ruleStats):
+    """Display the results found so far while the file is still being processed"""
+    # pandas and plotly are only loaded once there is something to display
+    import pandas as pd
+    import plotly.express as px
+
+    total = validCount + invalidCount
+
+    with placeholder.container():
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Records So Far", total)
+        with col2:
+            st.metric("Valid Records", validCount)
+        with col3:
+            st.metric("Invalid Records", invalidCount)
+        with col4:
+            st.metric("Percent Valid", f"{validCount / total * 100:.1f}%" if total else "-")
+
+        if ruleStats:
+            issuesdf = pd.DataFrame(list(ruleStats.items()), columns=["Issue Type", "Count"])
+            fig = px.bar(issuesdf, x="Issue Type", y="Count")
+            st.plotly_chart(fig, use_container_width=True)
+
+def run(inputFile, outputDirectory, refreshPages=5, refreshSeconds=1.0):
+    """
+    Run the app in a background thread, showing progress and partial results until it finishes
+
+    Partial results refresh every refreshPages pages, or every refreshSeconds for files without pages
+    """
+    app = None
+    errors = []
+
+    def work():
+        try:
             app.run()
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        app = App(inputFile, outputDirectory)
     except Exception as e:
         st.exception(e)
+        return
+
+    thread = threading.Thread(target=work, daemon=True)
+    started = time.monotonic()
+    thread.start()
+
+    progressBar = st.progress(0.0, text="Processing file...")
+    partialResults = st.empty()
+
+    # Rule counts are added up as invalid records arrive instead of recounting every refresh
+    ruleStats = {}
+    countedInvalid = 0
+    lastRefreshPage = 0
+    lastRefreshTime = started
+
+    while thread.is_alive():
+        time.sleep(0.2)
+
+        pagesDone, totalPages = app.extractor.progress()
+        validCount = len(app.processor.validRecords)
+        invalidCount = len(app.processor.invalidRecords)
+        elapsed = time.monotonic() - started
+        rate = (validCount + invalidCount) / elapsed
+
+        if totalPages:
+            progressBar.progress(min(pagesDone / totalPages, 1.0),
+                                 text=f"Page {pagesDone} of {totalPages} ({rate:.0f} records/sec)")
+        else:
+            progressBar.progress(0.0, text=f"{validCount + invalidCount} records ({rate:.0f} records/sec)")
+
+        if totalPages:
+            refresh = pagesDone - lastRefreshPage >= refreshPages
+        else:
+            refresh = time.monotonic() - lastRefreshTime >= refreshSeconds
+
+        if refresh:
+            for record, recordErrors in app.processor.invalidRecords[countedInvalid:invalidCount]:
+                for e in recordErrors:
+                    ruleStats[e.rule] = ruleStats.get(e.rule, 0) + 1
+            countedInvalid = invalidCount
+
+            displayProgress(partialResults, validCount, invalidCount, ruleStats)
+            lastRefreshPage = pagesDone
+            lastRefreshTime = time.monotonic()
+
+    thread.join()
+    progressBar.empty()
+    partialResults.empty()
+
+    if errors:
+        st.exception(errors[0])
 
 st.set_page_config(
     page_title="Patient Data Extractor",
@@ -141,13 +269,24 @@ st.set_page_config(
 )
 
 st.title("Patient Data Extractor")
-st.markdown("Upload a PDF to extract and validate patient records")
+st.markdown("Upload a PDF, CSV or Excel file to extract and validate patient records")
 
 
-uploadedFile = st.file_uploader("Choose a PDF file", type=["pdf"])
+uploadedFile = st.file_uploader("Choose a file", type=["pdf", "csv", "xlsx", "xlsm"])
 
 if uploadedFile is not None:
-    with tempfile.TemporaryDirectory() as tmpDir:
+    # Buttons rerun the whole script, so the upload is only processed once and its output kept
+    # in the session. Later reruns, e.g. paging through the valid records, only read the output
+    uploadKey = f"{uploadedFile.name}:{uploadedFile.size}:{getattr(uploadedFile, 'file_id', '')}"
+
+    if st.session_state.get("processedUpload") != uploadKey:
+        # Remove the output of the previous upload
+        previousDirectory = st.session_state.get("processedDirectory")
+        if previousDirectory:
+            shutil.rmtree(previousDirectory, ignore_errors=True)
+
+        tmpDir = tempfile.mkdtemp()
+
         # Save the file
         inputPDF = os.path.join(tmpDir, uploadedFile.name)
         with open(inputPDF, "wb") as f:
@@ -160,13 +299,18 @@ if uploadedFile is not None:
         # Run the app
         run(inputPDF, outputDirectory)
 
-        tab1, tab2, tab3 = st.tabs(["Valid Records", "Statistics", "Error Report"])
+        st.session_state["processedUpload"] = uploadKey
+        st.session_state["processedDirectory"] = tmpDir
+
+    outputDirectory = os.path.join(st.session_state["processedDirectory"], "output")
+
+    tab1, tab2, tab3 = st.tabs(["Valid Records", "Statistics", "Error Report"])
 
-        with tab1:
-            displayValidRecords(outputDirectory)
+    with tab1:
+        displayValidRecords(outputDirectory, uploadKey)
 
-        with tab2:
-            displayStatistics(outputDirectory)
+    with tab2:
+        displayStatistics(outputDirectory)
 
-        with tab3:
-            displayReport(outputDirectory)
\ No newline at end of file
+    with tab3:
+        displayReport(outputDirectory)
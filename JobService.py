@@ -0,0 +1,423 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from App import App
+from app.BatchWriter import BatchWriter
+from app.Metrics import getRegistry
+
+
+class Job:
+    """
+    A single uploaded file waiting for or going through processing
+
+    Attributes:
+        id: Unique identifier for the job
+        status: One of queued, running, done or failed
+        inputPath: Path to the uploaded file
+        outputDirectory: Directory where the output files are written
+        error: The error message if the job failed
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, jobId, inputPath, outputDirectory):
+        self.id = jobId
+        self.status = Job.QUEUED
+        self.inputPath = inputPath
+        self.outputDirectory = outputDirectory
+        self.error = None
+        self.submittedAt = datetime.now().isoformat()
+        self.startedAt = None
+        self.finishedAt = None
+
+    def toDictionary(self):
+        """
+        Convert the job to a dictionary
+
+        :return: A dictionary of the job
+        """
+        return {
+            "id": self.id,
+            "status": self.status,
+            "fileName": os.path.basename(self.inputPath),
+            "error": self.error,
+            "submittedAt": self.submittedAt,
+            "startedAt": self.startedAt,
+            "finishedAt": self.finishedAt
+        }
+
+
+class JobService:
+    """
+    Local HTTP service that accepts files and processes them with App on a pool of worker threads
+
+    Endpoints:
+        POST /jobs?name=<file name>   Upload a file as the request body. Returns the job id
+        GET  /jobs/<id>               The status of a job
+        GET  /jobs/<id>/statistics    The statistics.json content of a finished job
+        GET  /jobs/<id>/valid         The valid records CSV of a finished job
+        GET  /metrics                 Pipeline metrics in the Prometheus text format, when metrics are enabled
+
+    Uploads are held in a bounded queue. When the queue is full the service responds with 503 and a Retry-After header
+
+    Finished jobs are kept for retainSeconds, and only the newest retainJobs of them. Older jobs are forgotten
+    and their upload and output files deleted, so a long running service doesn't grow without bound
+    """
+
+    def __init__(self, workDirectory, host="127.0.0.1", port=8080, workers=2, queueSize=8, maxUploadBytes=100 * 1024 * 1024,
+                 databasePath=None, retainJobs=100, retainSeconds=3600):
+        """
+        Creates the job service
+
+        :param workDirectory: Directory where uploads and job output are stored
+        :param host: Host to bind to. Defaults to localhost only
+        :param port: Port to bind to. 0 picks a free port
+        :param workers: Number of worker threads processing jobs
+        :param queueSize: Number of jobs that can wait for a worker before uploads are rejected
+        :param maxUploadBytes: Largest accepted upload
+        :param databasePath: A SQLite database every job writes its valid records to through a single BatchWriter.
+            Each job writes its own records.db if not given
+        :param retainJobs: Number of finished jobs kept
+        :param retainSeconds: Seconds a finished job is kept
+        """
+        self.workDirectory = workDirectory
+        self.host = host
+        self.port = port
+        self.workerCount = workers
+        self.maxUploadBytes = maxUploadBytes
+        self.databasePath = databasePath
+        self.retainJobs = retainJobs
+        self.retainSeconds = retainSeconds
+        self.batchWriter = None
+
+        # Jobs waiting for a worker
+        self.queue = queue.Queue(maxsize=queueSize)
+
+        # Every job still retained, by id
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+        # Ids of finished jobs mapped to when they finished, oldest first
+        self.finishedJobs = OrderedDict()
+
+        self.server = None
+        self.threads = []
+
+        self.jobsCounter = getRegistry().counter(
+            "dataextractor_jobs_total", "Jobs handled by the job service, by outcome", ("status",))
+
+    def start(self):
+        """
+        Starts the HTTP server and the workers in background threads
+        """
+        os.makedirs(self.workDirectory, exist_ok=True)
+
+        if self.databasePath is not None:
+            self.batchWriter = BatchWriter(self.databasePath)
+            self.batchWriter.start()
+
+        self.server = ThreadingHTTPServer((self.host, self.port), JobRequestHandler)
+        self.server.service = self
+
+        # The real port, in case 0 was requested
+        self.port = self.server.server_address[1]
+
+        for _ in range(self.workerCount):
+            worker = threading.Thread(target=self.work, daemon=True)
+            worker.start()
+            self.threads.append(worker)
+
+        serverThread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        serverThread.start()
+        self.threads.append(serverThread)
+
+    def stop(self):
+        """
+        Stops accepting requests and waits for the workers to finish the job they are on
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+        # One sentinel per worker
+        for _ in range(self.workerCount):
+            self.queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.threads = []
+        self.server = None
+
+        # Every job is done, so whatever they submitted can be flushed
+        if self.batchWriter is not None:
+            self.batchWriter.close()
+            self.batchWriter = None
+
+    def submit(self, fileName, data):
+        """
+        Stores an uploaded file and queues it for processing
+
+        :param fileName: The name of the uploaded file
+        :param data: The file content
+        :return: The queued Job, or None if the queue is full
+        """
+        self.evictJobs()
+
+        jobId = uuid.uuid4().hex
+        jobDirectory = os.path.join(self.workDirectory, jobId)
+        outputDirectory = os.path.join(jobDirectory, "output")
+        os.makedirs(outputDirectory)
+
+        # Only keep the base name so uploads can't write outside the job directory
+        inputPath = os.path.join(jobDirectory, os.path.basename(fileName) or "upload.pdf")
+        with open(inputPath, "wb") as f:
+            f.write(data)
+
+        job = Job(jobId, inputPath, outputDirectory)
+
+        # Registered before queueing so a worker can never pick up a job that can't be looked up
+        with self.lock:
+            self.jobs[jobId] = job
+
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                del self.jobs[jobId]
+            self.jobsCounter.labels("rejected").inc()
+            os.remove(inputPath)
+            os.rmdir(outputDirectory)
+            os.rmdir(jobDirectory)
+            return None
+
+        return job
+
+    def getJob(self, jobId):
+        """
+        :param jobId: The job id
+        :return: The Job, or None if there is no job with that id
+        """
+        with self.lock:
+            return self.jobs.get(jobId)
+
+    def work(self):
+        """
+        Worker loop. Processes queued jobs until it receives a None sentinel
+        """
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+
+            job.status = Job.RUNNING
+            job.startedAt = datetime.now().isoformat()
+
+            try:
+                app = App(job.inputPath, job.outputDirectory, batchWriter=self.batchWriter)
+                app.run()
+                job.status = Job.DONE
+            except Exception as e:
+                job.error = str(e)
+                job.status = Job.FAILED
+
+            job.finishedAt = datetime.now().isoformat()
+            self.jobsCounter.labels(job.status).inc()
+
+            with self.lock:
+                self.finishedJobs[job.id] = time.monotonic()
+
+            self.evictJobs()
+
+    def evictJobs(self):
+        """
+        Forgets finished jobs past the retention limits and deletes their files
+        """
+        now = time.monotonic()
+        evicted = []
+
+        with self.lock:
+            while self.finishedJobs:
+                jobId, finishedAt = next(iter(self.finishedJobs.items()))
+                if len(self.finishedJobs) <= self.retainJobs and now - finishedAt <= self.retainSeconds:
+                    break
+
+                self.finishedJobs.popitem(last=False)
+                evicted.append(self.jobs.pop(jobId))
+
+        # Files are deleted outside the lock, a response already streaming keeps its open file
+        for job in evicted:
+            shutil.rmtree(os.path.dirname(job.inputPath), ignore_errors=True)
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes HTTP requests to the JobService stored on the server
+    """
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        service = self.server.service
+
+        if url.path.rstrip("/") != "/jobs":
+            self.sendJSON(404, {"error": "Not found"})
+            return
+
+        length = self.headers.get("Content-Length")
+        if length is None or not length.isdigit() or int(length) == 0:
+            self.sendJSON(411, {"error": "A Content-Length and a file body are required"})
+            return
+
+        if int(length) > service.maxUploadBytes:
+            self.sendJSON(413, {"error": f"Uploads are limited to {service.maxUploadBytes} bytes"})
+            return
+
+        fileName = parse_qs(url.query).get("name", ["upload.pdf"])[0]
+        data = self.rfile.read(int(length))
+
+        job = service.submit(fileName, data)
+
+        # Backpressure when every slot in the queue is taken
+        if job is None:
+            self.sendJSON(503, {"error": "The job queue is full, try again later"}, {"Retry-After": "1"})
+            return
+
+        self.sendJSON(202, job.toDictionary(), {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+
+        if parts == ["metrics"]:
+            self.sendMetrics()
+            return
+
+        if len(parts) < 2 or len(parts) > 3 or parts[0] != "jobs":
+            self.sendJSON(404, {"error": "Not found"})
+            return
+
+        job = self.server.service.getJob(parts[1])
+        if job is None:
+            self.sendJSON(404, {"error": f"No job with id '{parts[1]}'"})
+            return
+
+        if len(parts) == 2:
+            self.sendJSON(200, job.toDictionary())
+            return
+
+        # Results are only available once the job has finished
+        if job.status != Job.DONE:
+            self.sendJSON(409, job.toDictionary())
+            return
+
+        if parts[2] == "statistics":
+            self.sendFile(os.path.join(job.outputDirectory, "statistics.json"), "application/json")
+        elif parts[2] == "valid":
+            self.sendFile(os.path.join(job.outputDirectory, "valid_records.csv"), "text/csv")
+        else:
+            self.sendJSON(404, {"error": "Not found"})
+
+    def sendJSON(self, status, body, headers=None):
+        """
+        Sends a JSON response
+
+        :param status: The HTTP status code
+        :param body: The object to serialize
+        :param headers: Extra headers to send
+        """
+        data = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def sendMetrics(self):
+        """
+        Sends the pipeline metrics in the Prometheus text format
+        """
+        registry = getRegistry()
+        if not registry.enabled:
+            self.sendJSON(404, {"error": "Metrics are not enabled"})
+            return
+
+        data = registry.render().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def sendFile(self, path, contentType):
+        """
+        Sends a file as the response body
+
+        :param path: Path to the file
+        :param contentType: The content type of the file
+        """
+        if not os.path.exists(path):
+            self.sendJSON(404, {"error": f"'{os.path.basename(path)}' was not produced"})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        # Keep the console quiet, job status is available through the API
+        pass
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local HTTP service for submitting files to the extractor")
+    parser.add_argument("workDirectory", help="Directory where uploads and job output are stored")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--database", help="SQLite database shared by every job, written through a single writer")
+    parser.add_argument("--metrics", action="store_true", help="Serve pipeline metrics at /metrics")
+    parser.add_argument("--retain-jobs", type=int, default=100, help="Number of finished jobs kept (default: 100)")
+    parser.add_argument("--retain-seconds", type=float, default=3600,
+                        help="Seconds a finished job and its files are kept (default: 3600)")
+    args = parser.parse_args()
+
+    # Metrics have to be enabled before the components are created
+    if args.metrics:
+        getRegistry().enable()
+
+    service = JobService(args.workDirectory, args.host, args.port, args.workers, args.queue_size,
+                         databasePath=args.database, retainJobs=args.retain_jobs, retainSeconds=args.retain_seconds)
+    service.start()
+    print(f"Listening on http://{service.host}:{service.port}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        service.stop()
@@ -0,0 +1,295 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from app.SQLiteWriter import SQLiteWriter
+
+
+class BatchWriter:
+    """
+    The single writer for a SQLite database shared by many producers
+
+    Producers (App instances, threads, or other processes) put batches of records and run statistics on a bounded
+    queue instead of writing to the database themselves. One background thread owns the only write connection,
+    drains the queue and groups the batches into commits by row count or time, so producers never fight
+    over the write lock. A full queue blocks producers until the writer catches up.
+
+    Rows are written with SQLiteWriter's upsert (or insert or replace), keyed on patient id,
+    so a batch submitted twice can never duplicate a row.
+
+    Each batch is written inside its own savepoint. A batch that fails is rolled back on its own and reported
+    to its producer, the other batches of the same commit are still written. submit returns a Future that is
+    resolved once the batch is committed, or fails with the error that kept it out of the database.
+
+    Attributes:
+        dbWriter: The SQLiteWriter for the database
+        queue: The queue of batches. A multiprocessing queue when producers are other processes
+        counts: Rows inserted, updated and unchanged so far when upserting
+        rowsWritten: Rows committed so far
+        commits: Commits made so far
+        failedBatches: Batches that could not be written
+        error: The first error that kept a batch out of the database, if any
+    """
+
+    # Kinds of work on the queue
+    ROWS = "rows"
+    RUN = "run"
+
+    def __init__(self, dbPath, upsert=True, maxQueuedBatches=16, commitRows=5000, commitSeconds=1.0, batchQueue=None):
+        """
+        Creates a new BatchWriter. Call start before submitting
+
+        :param dbPath: Path to the SQLite database
+        :param upsert: Only write new or changed rows. Uses insert or replace otherwise
+        :param maxQueuedBatches: Number of batches that can wait before producers are blocked
+        :param commitRows: Commit once this many rows are waiting to be committed
+        :param commitSeconds: Commit rows that have waited this long, even if commitRows hasn't been reached
+        :param batchQueue: A queue shared with producers in other processes, from createProcessQueue
+        """
+        self.dbWriter = SQLiteWriter(dbPath)
+        self.upsert = upsert
+        self.commitRows = commitRows
+        self.commitSeconds = commitSeconds
+        self.queue = batchQueue if batchQueue is not None else queue.Queue(maxsize=maxQueuedBatches)
+
+        self.counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        self.rowsWritten = 0
+        self.commits = 0
+        self.failedBatches = 0
+        self.error = None
+
+        self.thread = None
+
+    @staticmethod
+    def createProcessQueue(maxQueuedBatches=16):
+        """
+        Creates a queue producers in other processes can submit to with submitTo
+
+        :param maxQueuedBatches: Number of batches that can wait before producers are blocked
+        :return: A multiprocessing queue to pass to BatchWriter and to the producer processes
+        """
+        import multiprocessing
+        return multiprocessing.Queue(maxQueuedBatches)
+
+    @staticmethod
+    def submitTo(batchQueue, records, timeout=None):
+        """
+        Puts a batch of records on a writer's queue. Safe to call from any thread or process
+
+        Records are converted to rows, including their content hash, before being queued
+        so that work is spread over the producers. Batches from other processes aren't acknowledged,
+        a batch that can't be written makes the writer's close raise
+
+        :param batchQueue: The writer's queue
+        :param records: The PatientRecord objects to write
+        :param timeout: Seconds to wait for room in the queue. Waits as long as it takes if None
+        :raises queue.Full: If the queue is still full after timeout seconds
+        """
+        rows = [SQLiteWriter.toRow(record) for record in records]
+
+        if rows:
+            batchQueue.put((BatchWriter.ROWS, rows, None), timeout=timeout)
+
+    def submit(self, records, timeout=None):
+        """
+        Puts a batch of records on the queue, waiting for room if it is full
+
+        :param records: The PatientRecord objects to write
+        :param timeout: Seconds to wait for room in the queue. Waits as long as it takes if None
+        :return: A Future resolved once the batch is committed, with the inserted, updated and unchanged counts
+            when upserting. Fails with the error if the batch couldn't be written
+        :raises queue.Full: If the queue is still full after timeout seconds
+        """
+        future = Future()
+        rows = [SQLiteWriter.toRow(record) for record in records]
+
+        if rows:
+            self.queue.put((self.ROWS, rows, future), timeout=timeout)
+        else:
+            future.set_result({"inserted": 0, "updated": 0, "unchanged": 0} if self.upsert else None)
+
+        return future
+
+    def submitRun(self, *runStats, timeout=None):
+        """
+        Puts the statistics of a run on the queue, so the run history goes through the same single writer
+
+        :param runStats: The arguments of SQLiteWriter.recordRun
+        :param timeout: Seconds to wait for room in the queue. Waits as long as it takes if None
+        :return: A Future resolved with the id of the run once it is committed
+        :raises queue.Full: If the queue is still full after timeout seconds
+        """
+        future = Future()
+        self.queue.put((self.RUN, runStats, future), timeout=timeout)
+        return future
+
+    def start(self):
+        """
+        Starts the writer thread
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """
+        Writes everything already submitted, commits, and stops the writer thread
+
+        :raises Exception: If any batch could not be written
+        """
+        if self.thread is not None:
+            # None marks the end of the queue, work is always a tuple
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+        if self.error is not None:
+            raise Exception(
+                f"{self.failedBatches} batches could not be written to '{self.dbWriter.dbPath}'\n"
+                f"Details: {str(self.error)}")
+
+    def run(self):
+        """
+        Writer loop. Drains the queue until it receives None
+        """
+        # Transactions are managed here, one per commit with a savepoint per batch
+        connection = sqlite3.connect(self.dbWriter.dbPath, isolation_level=None)
+
+        # Readers aren't blocked by the writer and vice versa
+        connection.execute("PRAGMA journal_mode=WAL")
+
+        # (kind, future, result, rows) for each batch written since the last commit
+        pending = []
+        pendingRows = 0
+        lastCommit = time.monotonic()
+
+        while True:
+            # Wake up in time to commit batches that have waited too long
+            timeout = None
+            if pending:
+                timeout = max(0.0, self.commitSeconds - (time.monotonic() - lastCommit))
+
+            try:
+                work = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                work = ()
+
+            if work is None:
+                break
+
+            if work:
+                kind, payload, future = work
+
+                # The commit timer starts with the first uncommitted batch
+                if not connection.in_transaction:
+                    connection.execute("BEGIN")
+                    lastCommit = time.monotonic()
+
+                written = self.write(connection, kind, payload, future)
+                if written is not None:
+                    pending.append(written)
+                    pendingRows += written[3]
+                elif not pending:
+                    # Don't hold the write lock for a transaction with nothing in it
+                    connection.execute("ROLLBACK")
+
+            if pending and (pendingRows >= self.commitRows or time.monotonic() - lastCommit >= self.commitSeconds):
+                self.commit(connection, pending)
+                pending = []
+                pendingRows = 0
+                lastCommit = time.monotonic()
+
+        if pending:
+            self.commit(connection, pending)
+        elif connection.in_transaction:
+            connection.execute("ROLLBACK")
+
+        connection.close()
+
+    def write(self, connection, kind, payload, future):
+        """
+        Writes one batch inside a savepoint, so a failure only rolls back that batch
+
+        :param connection: The writer's connection
+        :param kind: ROWS or RUN
+        :param payload: The rows, or the arguments of SQLiteWriter.recordRun
+        :param future: The producer's Future, None for producers in other processes
+        :return: (kind, future, result, rows) if the batch was written, None if it failed
+        """
+        started = time.perf_counter()
+        connection.execute("SAVEPOINT batch")
+
+        try:
+            if kind == self.RUN:
+                result = self.dbWriter.saveRun(connection, *payload)
+                rows = 0
+            elif self.upsert:
+                result = self.dbWriter.upsertRows(connection, payload)
+                rows = len(payload)
+            else:
+                self.dbWriter.insertRows(connection, payload)
+                result = None
+                rows = len(payload)
+        except Exception as e:
+            connection.execute("ROLLBACK TO SAVEPOINT batch")
+            connection.execute("RELEASE SAVEPOINT batch")
+            self.fail(future, e)
+            return None
+
+        connection.execute("RELEASE SAVEPOINT batch")
+
+        # Same metric as SQLiteWriter's own writes, so latency is reported when writes go through the queue too
+        if kind == self.ROWS:
+            operation = "upsert" if self.upsert else "insert"
+            self.dbWriter.writeSeconds.labels(operation).observe(time.perf_counter() - started)
+
+        return kind, future, result, rows
+
+    def commit(self, connection, pending):
+        """
+        Commits the batches written since the last commit and resolves their Futures
+
+        :param connection: The writer's connection
+        :param pending: (kind, future, result, rows) for each batch being committed
+        """
+        started = time.perf_counter()
+
+        try:
+            connection.execute("COMMIT")
+            self.dbWriter.writeSeconds.labels("commit").observe(time.perf_counter() - started)
+        except Exception as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+
+            # Nothing in the commit was saved, every producer in it is told
+            for kind, future, result, rows in pending:
+                self.fail(future, e)
+            return
+
+        self.commits += 1
+
+        for kind, future, result, rows in pending:
+            self.rowsWritten += rows
+
+            if kind == self.ROWS and self.upsert:
+                for outcome, count in result.items():
+                    self.counts[outcome] += count
+
+            if future is not None:
+                future.set_result(result)
+
+    def fail(self, future, error):
+        """
+        Records a batch that could not be written and passes the error to its producer
+
+        :param future: The producer's Future, None for producers in other processes
+        :param error: The error that kept the batch out of the database
+        """
+        self.failedBatches += 1
+
+        if self.error is None:
+            self.error = error
+
+        if future is not None:
+            future.set_exception(error)
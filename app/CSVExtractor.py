@@ -0,0 +1,70 @@
+import csv
+
+from app.Fields import Fields
+from app.InputSource import InputSource
+from app.PatientRecord import PatientRecord
+
+
+class CSVExtractor(InputSource):
+    """
+    Reads patient records from a CSV file
+
+    Rows are read one at a time, so reading uses the same memory no matter how large the file is.
+    RecordProcessor still keeps every record it is given for the output files
+
+    Attributes:
+        filePath: Path to the CSV file
+    """
+
+    def iterRecords(self):
+        """
+        Reads patient records from a CSV file
+
+        Notes:
+            The first non-blank row is skipped if it is the header
+            Assumes the columns are in the order patient id, health card numbers, version code, date of birth, service date
+
+        :return: A generator of PatientRecord objects
+        """
+        try:
+            # utf-8-sig drops the byte order mark spreadsheet programs add
+            with open(self.filePath, "r", newline="", encoding="utf-8-sig") as f:
+                reader = csv.reader(f)
+                recordCount = 0
+                firstRow = True
+
+                for row in reader:
+                    # Skips blank lines
+                    if not row or not any(cell.strip() for cell in row):
+                        continue
+
+                    # The header is the first row with data, wherever blank lines leave it
+                    if firstRow:
+                        firstRow = False
+                        if self.isHeader(row, Fields.getAllFields()):
+                            continue
+
+                    if len(row) != 5:
+                        raise Exception(
+                            f"Incomplete record found in '{self.filePath}' on line {reader.line_num}\n"
+                            f"Ensure that all rows are present and have 5 fields"
+                        )
+
+                    recordCount += 1
+                    yield PatientRecord(row[0], row[1], row[2], row[3], row[4], rowNumber=reader.line_num)
+
+            # Raise an exception if there are no records, e.g. only a header
+            if not recordCount:
+                raise Exception(
+                    f"The file '{self.filePath}' does not contain any records\n"
+                    f"Ensure the CSV has at least one row of patient data")
+        # Raise an exception if the file isn't found
+        except FileNotFoundError as e:
+            raise Exception(
+                f"CSV file '{self.filePath}' was not found\n"
+                f"Details: {str(e)}")
+        # Raise an error if the file isn't valid CSV or text
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise Exception(
+                f"The file '{self.filePath}' is not a valid CSV file\n"
+                f"Details: {str(e)}")
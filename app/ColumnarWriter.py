@@ -0,0 +1,219 @@
+from datetime import datetime
+
+
+class ColumnarWriter:
+    """
+    Writes valid patient records to a columnar file for analytics
+
+    Formats, in order of preference:
+        1. Parquet, when pyarrow is installed
+        2. Arrow IPC, when pyarrow is installed without parquet support
+        3. NumPy .npz, when only numpy is installed
+
+    Dates are written as date columns and the version code is dictionary encoded.
+    Records are converted one batch at a time, straight into columns.
+    """
+
+    PARQUET = "parquet"
+    ARROW = "arrow"
+    NPZ = "npz"
+
+    EXTENSIONS = {
+        PARQUET: ".parquet",
+        ARROW: ".arrow",
+        NPZ: ".npz",
+    }
+
+    # The date format the Validator accepts. Single digit months and days pass it, so fromisoformat can't be used
+    DATE_FORMAT = "%Y-%m-%d"
+
+    def __init__(self, validRecords, batchSize=10000):
+        """
+        Creates a new ColumnarWriter
+
+        :param validRecords: The records to write
+        :param batchSize: The number of records converted to columns at a time
+        """
+        self.validRecords = validRecords
+        self.batchSize = batchSize
+
+    @classmethod
+    def availableFormat(cls):
+        """
+        Finds the best format that can be written with the installed packages
+
+        :return: The format name, or None if neither pyarrow nor numpy is installed
+        """
+        try:
+            import pyarrow.parquet
+            return cls.PARQUET
+        except ImportError:
+            pass
+
+        try:
+            import pyarrow.ipc
+            return cls.ARROW
+        except ImportError:
+            pass
+
+        try:
+            import numpy
+            return cls.NPZ
+        except ImportError:
+            return None
+
+    def write(self, basePath, fileFormat=None):
+        """
+        Writes the records to a columnar file
+
+        :param basePath: Output path without the extension. The extension of the format is added
+        :param fileFormat: parquet, arrow or npz. Picks the best available format if not given
+        :return: The path of the file written
+        """
+        if fileFormat is None:
+            fileFormat = self.availableFormat()
+
+        if fileFormat is None:
+            raise Exception(
+                "Columnar output requires pyarrow or numpy\n"
+                "Install pyarrow with `pip install pyarrow`")
+
+        if fileFormat not in self.EXTENSIONS:
+            raise Exception(f"Unknown columnar format '{fileFormat}'. Expected one of {', '.join(self.EXTENSIONS)}")
+
+        path = basePath + self.EXTENSIONS[fileFormat]
+
+        if fileFormat == self.NPZ:
+            self.writeNPZ(path)
+        else:
+            self.writeArrow(path, fileFormat)
+
+        return path
+
+    def batches(self):
+        """
+        Splits the records into batches of columns
+
+        The version code column holds integer codes into versionCodeCategories. New codes are only ever appended,
+        so the categories seen by an earlier batch are a prefix of the categories seen by a later one.
+        Dates are parsed to date objects
+
+        :return: A generator of dictionaries mapping each column name to a list of values
+        """
+        categories = []
+        codeLookup = {}
+
+        for start in range(0, len(self.validRecords), self.batchSize):
+            batch = self.validRecords[start:start + self.batchSize]
+
+            codes = []
+            for record in batch:
+                code = codeLookup.get(record.versionCode)
+                if code is None:
+                    code = codeLookup[record.versionCode] = len(categories)
+                    categories.append(record.versionCode)
+                codes.append(code)
+
+            yield {
+                "patientId": [record.patientId for record in batch],
+                "healthCardNumber": [record.healthCardNumber for record in batch],
+                "versionCode": codes,
+                "versionCodeCategories": list(categories),
+                "dateOfBirth": [self.parseDate(record.dateOfBirth) for record in batch],
+                "serviceDate": [self.parseDate(record.serviceDate) for record in batch],
+            }
+
+    @classmethod
+    def parseDate(cls, value):
+        """
+        Parses a date the same way the Validator does
+
+        :param value: A date string from a valid record
+        :return: The date
+        """
+        return datetime.strptime(str(value), cls.DATE_FORMAT).date()
+
+    def writeArrow(self, path, fileFormat):
+        """
+        Writes the records with pyarrow, one record batch or row group per batch
+
+        :param path: Output file path
+        :param fileFormat: parquet or arrow
+        """
+        import pyarrow as pa
+
+        schema = pa.schema([
+            ("patientId", pa.string()),
+            ("healthCardNumber", pa.string()),
+            ("versionCode", pa.dictionary(pa.int32(), pa.string())),
+            ("dateOfBirth", pa.date32()),
+            ("serviceDate", pa.date32()),
+        ])
+
+        if fileFormat == self.PARQUET:
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(path, schema)
+        else:
+            import pyarrow.ipc
+            # The dictionary only grows between batches, which the IPC file format allows as deltas
+            writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+        try:
+            for columns in self.batches():
+                batch = pa.record_batch([
+                    pa.array(columns["patientId"], pa.string()),
+                    pa.array(columns["healthCardNumber"], pa.string()),
+                    pa.DictionaryArray.from_arrays(
+                        pa.array(columns["versionCode"], pa.int32()),
+                        pa.array(columns["versionCodeCategories"], pa.string())
+                    ),
+                    pa.array(columns["dateOfBirth"], pa.date32()),
+                    pa.array(columns["serviceDate"], pa.date32()),
+                ], schema=schema)
+
+                writer.write_batch(batch)
+        finally:
+            writer.close()
+
+    def writeNPZ(self, path):
+        """
+        Writes the records to a compressed NumPy archive
+
+        Dates are stored as datetime64[D]. The version code is stored as integer codes in versionCode
+        with the distinct values in versionCodeCategories
+
+        :param path: Output file path
+        """
+        import numpy as np
+
+        chunks = {
+            "patientId": [],
+            "healthCardNumber": [],
+            "versionCode": [],
+            "dateOfBirth": [],
+            "serviceDate": [],
+        }
+        categories = []
+
+        for columns in self.batches():
+            chunks["patientId"].append(np.array(columns["patientId"], dtype=str))
+            chunks["healthCardNumber"].append(np.array(columns["healthCardNumber"], dtype=str))
+            chunks["versionCode"].append(np.array(columns["versionCode"], dtype=np.int32))
+            categories = columns["versionCodeCategories"]
+            chunks["dateOfBirth"].append(np.array(columns["dateOfBirth"], dtype="datetime64[D]"))
+            chunks["serviceDate"].append(np.array(columns["serviceDate"], dtype="datetime64[D]"))
+
+        arrays = {}
+        for name, parts in chunks.items():
+            if parts:
+                arrays[name] = np.concatenate(parts)
+            elif name in ("dateOfBirth", "serviceDate"):
+                arrays[name] = np.array([], dtype="datetime64[D]")
+            elif name == "versionCode":
+                arrays[name] = np.array([], dtype=np.int32)
+            else:
+                arrays[name] = np.array([], dtype=str)
+
+        arrays["versionCodeCategories"] = np.array(categories, dtype=str)
+
+        np.savez_compressed(path, **arrays)
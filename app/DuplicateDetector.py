@@ -0,0 +1,135 @@
+import sqlite3
+
+from app.Fields import Fields
+from app.Metrics import getRegistry
+from app.Rules import Rules
+from app.ValidationError import ValidationError
+
+
+class DuplicateDetector:
+    """
+    Finds valid records that repeat another record
+
+    Checks:
+        - Repeat claims: the same health card number and service date under a different patient id
+        - Duplicate health card numbers: the same health card number under a different patient id
+
+    Records are checked against the earlier records of the same run with an in-memory hash index,
+    and against the records already in the database with one indexed query per batch of health card numbers.
+    Within a run every repeat claim is flagged, even under the same patient id, since the database would
+    otherwise silently collapse the rows into one. A record with the same patient id as a row saved by an earlier run
+    is that record being loaded again, not a duplicate.
+    """
+
+    def __init__(self, dbPath=None, lookupBatchSize=500):
+        """
+        Creates a new DuplicateDetector
+
+        :param dbPath: Path to the SQLite database holding earlier runs. Only checks within the run if None
+        :param lookupBatchSize: Number of health card numbers looked up in the database per query
+        """
+        self.dbPath = dbPath
+        self.lookupBatchSize = lookupBatchSize
+
+        self.failuresCounter = getRegistry().counter(
+            "dataextractor_validation_failures_total", "Validation errors found, by rule and field", ("rule", "field"))
+
+    def findDuplicates(self, records):
+        """
+        Checks records for duplicates. The first record of a group stays valid, the later ones are flagged
+
+        :param records: The valid PatientRecord objects, in the order they were read
+        :return: A dictionary mapping the position of each duplicate record in records to its ValidationError list
+        """
+        duplicates = {}
+
+        # Health card number mapped to the first patient id seen with it, and the same for each claim
+        cards = {}
+        claims = {}
+
+        # Matches found in the database for each health card number already looked up
+        stored = {}
+
+        for start in range(0, len(records), self.lookupBatchSize):
+            batch = records[start:start + self.lookupBatchSize]
+
+            if self.dbPath is not None:
+                self.lookupStored([record.healthCardNumber for record in batch], stored)
+
+            for position, record in enumerate(batch, start=start):
+                errors = self.checkRecord(record, cards, claims, stored)
+
+                if errors:
+                    duplicates[position] = errors
+                    for error in errors:
+                        self.failuresCounter.labels(error.rule, error.field).inc()
+
+                cards.setdefault(record.healthCardNumber, record.patientId)
+                claims.setdefault((record.healthCardNumber, record.serviceDate), record.patientId)
+
+        return duplicates
+
+    def checkRecord(self, record, cards, claims, stored):
+        """
+        Checks one record against the run so far and the database
+
+        :param record: The PatientRecord object
+        :param cards: Health card number mapped to the first patient id seen with it in this run
+        :param claims: (health card number, service date) mapped to the first patient id seen with it in this run
+        :param stored: Health card number mapped to the (patient id, service date) pairs stored in the database
+        :return: A list of ValidationError objects. Empty if the record isn't a duplicate
+        """
+        card = record.healthCardNumber
+
+        # Repeat claims are the more specific problem, so they are reported instead of the duplicate card
+        claimPatient = claims.get((card, record.serviceDate))
+        if claimPatient is not None:
+            return [ValidationError(Fields.SERVICE_DATE, Rules.DUPLICATE,
+                                    f"The health card number and service date repeat a claim for patient {claimPatient}")]
+
+        for patientId, serviceDate in stored.get(card, []):
+            if patientId != record.patientId and serviceDate == record.serviceDate:
+                return [ValidationError(Fields.SERVICE_DATE, Rules.DUPLICATE,
+                                        f"The health card number and service date repeat a claim already saved for patient {patientId}")]
+
+        cardPatient = cards.get(card)
+        if cardPatient is not None and cardPatient != record.patientId:
+            return [ValidationError(Fields.HEALTH_CARD_NUMBER, Rules.DUPLICATE,
+                                    f"The health card number is also used by patient {cardPatient}")]
+
+        for patientId, serviceDate in stored.get(card, []):
+            if patientId != record.patientId:
+                return [ValidationError(Fields.HEALTH_CARD_NUMBER, Rules.DUPLICATE,
+                                        f"The health card number is already saved for patient {patientId}")]
+
+        return []
+
+    def lookupStored(self, cards, stored):
+        """
+        Looks up the health card numbers that haven't been looked up yet in the database
+
+        :param cards: The health card numbers of a batch of records
+        :param stored: Health card number mapped to the (patient id, service date) pairs stored in the database.
+            Updated with the new health card numbers
+        """
+        missing = list({card for card in cards if card not in stored})
+        if not missing:
+            return
+
+        for card in missing:
+            stored[card] = []
+
+        connection = sqlite3.connect(self.dbPath)
+        cursor = connection.cursor()
+
+        # Uses the health card number index, one query for the whole batch
+        placeholders = ", ".join("?" * len(missing))
+        cursor.execute(
+            f'SELECT healthCardNumber, patientId, serviceDate FROM patientRecords WHERE healthCardNumber IN ({placeholders})',
+            missing
+        )
+
+        for card, patientId, serviceDate in cursor.fetchall():
+            stored[card].append((patientId, serviceDate))
+
+        connection.close()
@@ -0,0 +1,213 @@
+import json
+
+from app.OutputWriter import OutputWriter
+from app.PatientRecord import PatientRecord
+from app.ValidationError import ValidationError
+
+
+class ErrorLog:
+    """
+    Machine readable log of the invalid records
+
+    Writes one JSON line per invalid record, with its fields, its errors and where it was found in the input.
+    A side index maps each patient id to the position of its line. The index is sorted by patient id and every
+    entry has the same width, so a lookup binary searches the index file with O(log n) seeks instead of
+    reading the index or scanning the whole log.
+
+    When compressed, the log is written as a series of independent gzip members of BLOCK_SIZE records each.
+    The index then stores the offset of the member and the offset of the line inside it,
+    so a lookup only decompresses one block.
+
+    Attributes:
+        path: Path to the log. Ends in .gz when compressed
+        indexPath: Path to the patient id index
+        compress: If the log is gzip compressed
+    """
+
+    # Records per gzip member when compressed
+    BLOCK_SIZE = 256
+
+    def __init__(self, path, compress=False):
+        """
+        Creates a new ErrorLog
+
+        :param path: Path to the log. .gz is added when compressed and missing
+        :param compress: Write the log gzip compressed
+        """
+        if compress and not path.endswith(".gz"):
+            path += ".gz"
+
+        self.path = path
+        self.indexPath = f"{path}.idx"
+        self.compress = compress
+
+    def write(self, invalidRecords):
+        """
+        Writes the invalid records and their index
+
+        :param invalidRecords: A list of tuples, containing the record and its errors
+        """
+        index = []
+
+        with open(self.path, "wb") as f:
+            if self.compress:
+                # gzip is only needed for compressed logs
+                import gzip
+
+                for start in range(0, len(invalidRecords), self.BLOCK_SIZE):
+                    memberOffset = f.tell()
+                    block = bytearray()
+
+                    for record, errors in invalidRecords[start:start + self.BLOCK_SIZE]:
+                        index.append((record.patientId, f"{memberOffset}:{len(block)}"))
+                        block += self.toLine(record, errors)
+
+                    f.write(gzip.compress(bytes(block)))
+            else:
+                for record, errors in invalidRecords:
+                    index.append((record.patientId, str(f.tell())))
+                    f.write(self.toLine(record, errors))
+
+        # The id is JSON encoded so tabs or line breaks in it can't break the index, and is ASCII so widths are bytes.
+        # The sort is stable, so the entries of a patient stay in log order
+        entries = sorted(((json.dumps(patientId), position) for patientId, position in index), key=lambda entry: entry[0])
+
+        keyWidth = max((len(key) for key, _ in entries), default=0)
+        positionWidth = max((len(position) for _, position in entries), default=0)
+
+        with open(self.indexPath, "w", encoding="ascii") as f:
+            for key, position in entries:
+                f.write(f"{key.ljust(keyWidth)}\t{position.ljust(positionWidth)}\n")
+
+    def toLine(self, record, errors):
+        """
+        Converts an invalid record to its line in the log
+
+        :param record: The PatientRecord object
+        :param errors: The ValidationError objects of the record
+        :return: The JSON line as bytes
+        """
+        entry = {
+            "patientId": record.patientId,
+            "pageNumber": record.pageNumber,
+            "rowNumber": record.rowNumber,
+            "record": {
+                "healthCardNumber": record.healthCardNumber,
+                "versionCode": record.versionCode,
+                "dateOfBirth": record.dateOfBirth,
+                "serviceDate": record.serviceDate
+            },
+            "errors": [error.toDictionary() for error in errors]
+        }
+
+        return (json.dumps(entry) + "\n").encode("utf-8")
+
+    def findPositions(self, patientId):
+        """
+        Binary searches the index for the positions of a patient's lines
+
+        :param patientId: The patient id to look up
+        :return: The positions of the patient's lines, in log order
+        """
+        key = json.dumps(patientId).encode("ascii")
+        positions = []
+
+        with open(self.indexPath, "rb") as f:
+            entryWidth = len(f.readline())
+            if not entryWidth:
+                return positions
+
+            f.seek(0, 2)
+            entryCount = f.tell() // entryWidth
+
+            def readEntry(entryNumber):
+                f.seek(entryNumber * entryWidth)
+                entryKey, _, position = f.read(entryWidth).rstrip(b"\n").partition(b"\t")
+                return entryKey.rstrip(b" "), position.rstrip(b" ").decode("ascii")
+
+            # The first entry not before the key
+            low, high = 0, entryCount
+            while low < high:
+                middle = (low + high) // 2
+                if readEntry(middle)[0] < key:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            for entryNumber in range(low, entryCount):
+                entryKey, position = readEntry(entryNumber)
+                if entryKey != key:
+                    break
+                positions.append(position)
+
+        return positions
+
+    def lookup(self, patientId):
+        """
+        Finds the log entries of a patient
+
+        :param patientId: The patient id to look up
+        :return: A list of the patient's entries as dictionaries. Empty if the patient had no invalid records
+        """
+        entries = []
+
+        with open(self.path, "rb") as f:
+            for position in self.findPositions(patientId):
+                if self.compress:
+                    import gzip
+
+                    memberOffset, _, lineOffset = position.partition(":")
+                    f.seek(int(memberOffset))
+
+                    # Only the block holding the line is decompressed
+                    with gzip.GzipFile(fileobj=f, mode="rb") as block:
+                        block.seek(int(lineOffset))
+                        line = block.readline()
+                else:
+                    f.seek(int(position))
+                    line = f.readline()
+
+                entries.append(json.loads(line))
+
+        return entries
+
+    def readRecords(self):
+        """
+        Reads every invalid record back from the log in the order they were written
+
+        :return: A generator of tuples, containing the PatientRecord and its ValidationError objects
+        """
+        if self.compress:
+            import gzip
+            opener = gzip.open
+        else:
+            opener = open
+
+        with opener(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                fields = entry["record"]
+
+                record = PatientRecord(
+                    entry["patientId"],
+                    fields["healthCardNumber"],
+                    fields["versionCode"],
+                    fields["dateOfBirth"],
+                    fields["serviceDate"],
+                    entry["pageNumber"],
+                    entry["rowNumber"]
+                )
+                errors = [ValidationError(error["field"], error["rule"], error["message"]) for error in entry["errors"]]
+
+                yield record, errors
+
+    def renderTextReport(self, path, validCount, pageStats=None):
+        """
+        Writes the text error report from the log
+
+        :param path: Output file path for the report
+        :param validCount: The number of valid records in the run
+        :param pageStats: Page counts from the extractor, if the input had pages
+        """
+        outputWriter = OutputWriter([], list(self.readRecords()), pageStats, validCount)
+        outputWriter.writeErrorReport(path)
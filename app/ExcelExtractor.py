@@ -0,0 +1,108 @@
+from datetime import date, datetime
+
+from app.Fields import Fields
+from app.InputSource import InputSource
+from app.PatientRecord import PatientRecord
+
+
+class ExcelExtractor(InputSource):
+    """
+    Reads patient records from an Excel workbook
+
+    Every worksheet is read like a page of the PDF. Rows are streamed with openpyxl's read only mode
+
+    Attributes:
+        filePath: Path to the .xlsx file
+    """
+
+    def iterRecords(self):
+        """
+        Reads patient records from every worksheet of an Excel workbook
+
+        Notes:
+            The first non-blank row of each worksheet is skipped if it is the header
+            Assumes the columns are in the order patient id, health card numbers, version code, date of birth, service date
+
+        :return: A generator of PatientRecord objects
+        """
+        # openpyxl is only needed for Excel files
+        try:
+            import openpyxl
+        except ImportError:
+            raise Exception(
+                "Reading Excel files requires openpyxl\n"
+                "Install it with `pip install openpyxl`")
+
+        try:
+            workbook = openpyxl.load_workbook(self.filePath, read_only=True, data_only=True)
+        except FileNotFoundError as e:
+            raise Exception(
+                f"Excel file '{self.filePath}' was not found\n"
+                f"Details: {str(e)}")
+        except Exception as e:
+            raise Exception(
+                f"The file '{self.filePath}' is not a valid Excel file or has been corrupted\n"
+                f"Details: {str(e)}")
+
+        recordCount = 0
+
+        try:
+            for sheetNumber, sheet in enumerate(workbook.worksheets, start=1):
+                firstRow = True
+
+                for rowNumber, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+                    row = [self.toText(cell) for cell in row]
+
+                    # Empty cells at the end of a row are read as blanks
+                    while len(row) > 5 and row[-1] == "":
+                        row.pop()
+
+                    # Skips blank rows
+                    if not any(row):
+                        continue
+
+                    # The header is the first row with data, wherever the table starts on the sheet
+                    if firstRow:
+                        firstRow = False
+                        if self.isHeader(row, Fields.getAllFields()):
+                            continue
+
+                    # Blank cells inside the table are kept for the validator, like empty PDF cells,
+                    # but a sheet without all 5 columns is rejected like a short CSV or PDF row
+                    if len(row) != 5:
+                        raise Exception(
+                            f"Incomplete record found in '{self.filePath}' on sheet '{sheet.title}' row {rowNumber}\n"
+                            f"Ensure that all rows are present and have 5 fields"
+                        )
+
+                    recordCount += 1
+                    yield PatientRecord(row[0], row[1], row[2], row[3], row[4], sheetNumber, rowNumber)
+        finally:
+            workbook.close()
+
+        # Raise an exception if there are no records, e.g. only a header
+        if not recordCount:
+            raise Exception(
+                f"The file '{self.filePath}' does not contain any records\n"
+                f"Ensure the workbook has at least one row of patient data")
+
+    def toText(self, cell):
+        """
+        Converts a cell value to the text the PDF would have held
+
+        :param cell: The cell value
+        :return: The value as text. Dates are YYYY-MM-DD and whole numbers have no decimal point
+        """
+        if cell is None:
+            return ""
+
+        if isinstance(cell, datetime):
+            return cell.date().isoformat()
+
+        if isinstance(cell, date):
+            return cell.isoformat()
+
+        if isinstance(cell, float) and cell.is_integer():
+            return str(int(cell))
+
+        return str(cell)
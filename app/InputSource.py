@@ -0,0 +1,70 @@
+class InputSource:
+    """
+    Base class for the sources that RecordProcessor reads patient records from
+
+    Subclasses implement iterRecords, yielding PatientRecord objects one at a time so reading a large input
+    doesn't hold the whole file in memory
+
+    Attributes:
+        filePath: Path to the input file
+        pageStats: Page counts from the last extraction. None for sources without pages
+    """
+
+    def __init__(self, filePath):
+        """
+        Creates a new InputSource
+
+        :param filePath: Path to the file that contains patient data
+        """
+        self.filePath = filePath
+        self.pageStats = None
+
+    def iterRecords(self):
+        """
+        Reads the patient records from the source
+
+        :return: A generator of PatientRecord objects
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not implement iterRecords")
+
+    def extractRecords(self):
+        """
+        Reads every patient record from the source
+
+        :return: A list of PatientRecord objects
+        """
+        return list(self.iterRecords())
+
+    def progress(self):
+        """
+        How far the current extraction has got, for sources that know their size up front
+
+        :return: (done, total) in pages. (None, None) if the source has no pages
+        """
+        return None, None
+
+    def isHeader(self, row, headerData):
+        """
+        Checks if a row is the header by comparing its letters, ignoring case, spaces and punctuation
+
+        :param row: The row to check
+        :param headerData: The header data to look for
+        :return: If the row contains every entry of headerData
+        """
+        normalizedRow = [''.join(char.lower() for char in str(cell or "") if char.isalpha()) for cell in row]
+
+        return headerData.issubset(normalizedRow)
+
+    def removeHeader(self, table, headerData):
+        """
+        Removes a header from a table if the header contains headerData. Assumes the first row of a table is the header.
+
+        :param table: A table to remove the header from
+        :param headerData: The header data to look for
+        :return: A table with the header removed. If no header present, returns table
+        """
+        if self.isHeader(table[0], headerData):
+            table.pop(0)
+            return table
+        else:
+            return table
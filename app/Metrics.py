@@ -0,0 +1,357 @@
+import os
+import re
+import threading
+
+
+class Counter:
+    """
+    A value that only goes up, e.g. the number of pages processed
+    """
+
+    def __init__(self, name, description, labelNames=()):
+        """
+        Creates a counter
+
+        :param name: The metric name
+        :param description: The help text for the metric
+        :param labelNames: The names of the labels the counter is split by
+        """
+        self.name = name
+        self.description = description
+        self.labelNames = labelNames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *labelValues):
+        """
+        :param labelValues: One value per label name
+        :return: The counter for those label values
+        """
+        return LabeledMetric(self, tuple(str(value) for value in labelValues))
+
+    def inc(self, amount=1, labelValues=()):
+        """
+        Adds to the counter
+
+        :param amount: The amount to add
+        :param labelValues: One value per label name
+        """
+        with self.lock:
+            self.values[labelValues] = self.values.get(labelValues, 0) + amount
+
+    def samples(self):
+        """
+        :return: A list of (sample name, labels, value) tuples for the text format
+        """
+        with self.lock:
+            values = dict(self.values)
+
+        return [(self.name, formatLabels(self.labelNames, labelValues), value) for labelValues, value in values.items()]
+
+
+class Histogram:
+    """
+    Counts observed values into buckets, e.g. how long each SQLite write took
+    """
+
+    # Seconds, from a millisecond up to a minute
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+    def __init__(self, name, description, labelNames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Creates a histogram
+
+        :param name: The metric name
+        :param description: The help text for the metric
+        :param labelNames: The names of the labels the histogram is split by
+        :param buckets: The upper bounds of the buckets, in increasing order
+        """
+        self.name = name
+        self.description = description
+        self.labelNames = labelNames
+        self.buckets = tuple(buckets)
+
+        # Label values mapped to [count per bucket, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *labelValues):
+        """
+        :param labelValues: One value per label name
+        :return: The histogram for those label values
+        """
+        return LabeledMetric(self, tuple(str(value) for value in labelValues))
+
+    def observe(self, value, labelValues=()):
+        """
+        Records a value
+
+        :param value: The value to record
+        :param labelValues: One value per label name
+        """
+        with self.lock:
+            entry = self.values.get(labelValues)
+            if entry is None:
+                entry = self.values[labelValues] = [[0] * len(self.buckets), 0, 0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        """
+        :return: A list of (sample name, labels, value) tuples for the text format
+        """
+        with self.lock:
+            values = {labelValues: (list(entry[0]), entry[1], entry[2]) for labelValues, entry in self.values.items()}
+
+        samples = []
+        for labelValues, (bucketCounts, total, count) in values.items():
+            for bound, bucketCount in zip(self.buckets, bucketCounts):
+                labels = formatLabels(self.labelNames + ("le",), labelValues + (formatValue(bound),))
+                samples.append((f"{self.name}_bucket", labels, bucketCount))
+
+            labels = formatLabels(self.labelNames + ("le",), labelValues + ("+Inf",))
+            samples.append((f"{self.name}_bucket", labels, count))
+            samples.append((f"{self.name}_sum", formatLabels(self.labelNames, labelValues), total))
+            samples.append((f"{self.name}_count", formatLabels(self.labelNames, labelValues), count))
+
+        return samples
+
+
+class LabeledMetric:
+    """
+    A counter or histogram with its label values filled in
+    """
+
+    def __init__(self, metric, labelValues):
+        self.metric = metric
+        self.labelValues = labelValues
+
+    def inc(self, amount=1):
+        self.metric.inc(amount, self.labelValues)
+
+    def observe(self, value):
+        self.metric.observe(value, self.labelValues)
+
+
+class NullMetric:
+    """
+    Stands in for every metric while metrics are disabled, so recording a value does nothing
+    """
+
+    def labels(self, *labelValues):
+        return self
+
+    def inc(self, amount=1, labelValues=()):
+        pass
+
+    def observe(self, value, labelValues=()):
+        pass
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of the pipeline and writes them in the Prometheus text format
+
+    Disabled by default. While disabled every metric is a NullMetric, so the pipeline pays nothing for them.
+    Components look their metrics up when they are created, so the registry has to be enabled before then
+
+    Attributes:
+        enabled: If metrics are being recorded
+    """
+
+    NULL_METRIC = NullMetric()
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+        # Samples read from an earlier run's text file, added to this run's values
+        self.baseline = {}
+
+    def enable(self):
+        """
+        Starts recording metrics
+        """
+        self.enabled = True
+
+    def counter(self, name, description, labelNames=()):
+        """
+        Gets or creates a counter
+
+        :param name: The metric name. Counters end in _total by convention
+        :param description: The help text for the metric
+        :param labelNames: The names of the labels the counter is split by
+        :return: The Counter, or a NullMetric while disabled
+        """
+        if not self.enabled:
+            return self.NULL_METRIC
+
+        return self.getOrCreate(name, lambda: Counter(name, description, tuple(labelNames)))
+
+    def histogram(self, name, description, labelNames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        """
+        Gets or creates a histogram
+
+        :param name: The metric name
+        :param description: The help text for the metric
+        :param labelNames: The names of the labels the histogram is split by
+        :param buckets: The upper bounds of the buckets, in increasing order
+        :return: The Histogram, or a NullMetric while disabled
+        """
+        if not self.enabled:
+            return self.NULL_METRIC
+
+        return self.getOrCreate(name, lambda: Histogram(name, description, tuple(labelNames), buckets))
+
+    def getOrCreate(self, name, create):
+        """
+        :param name: The metric name
+        :param create: Creates the metric if it isn't registered yet
+        :return: The registered metric
+        """
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = create()
+            return metric
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text format, including values carried over from loadTextFile
+
+        :return: The metrics as text
+        """
+        # Metric name mapped to [type, help, {(sample name, labels): value}]
+        families = {}
+
+        for name, (metricType, description, samples) in self.baseline.items():
+            families[name] = [metricType, description, dict(samples)]
+
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        for metric in metrics:
+            metricType = "counter" if isinstance(metric, Counter) else "histogram"
+            family = families.setdefault(metric.name, [metricType, metric.description, {}])
+
+            for sampleName, labels, value in metric.samples():
+                key = (sampleName, labels)
+                family[2][key] = family[2].get(key, 0) + value
+
+        lines = []
+        for name, (metricType, description, samples) in families.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metricType}")
+            for (sampleName, labels), value in samples.items():
+                lines.append(f"{sampleName}{labels} {formatValue(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def writeTextFile(self, path):
+        """
+        Writes the metrics to a file, e.g. for the node exporter's textfile collector
+
+        The file is replaced in one step so a scrape never sees a half written file
+
+        :param path: Output path for the metrics file
+        """
+        temporaryPath = f"{path}.{os.getpid()}.tmp"
+
+        with open(temporaryPath, "w") as f:
+            f.write(self.render())
+
+        os.replace(temporaryPath, path)
+
+    def loadTextFile(self, path):
+        """
+        Carries the values in a metrics file written by an earlier run over into this run
+
+        Lets separate batch runs keep adding to the same counters and histograms. Does nothing if the file doesn't exist
+
+        :param path: Path to a metrics file written by writeTextFile
+        """
+        if not os.path.exists(path):
+            return
+
+        baseline = {}
+        family = None
+
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+
+                if line.startswith("# HELP "):
+                    name, _, description = line[len("# HELP "):].partition(" ")
+                    family = baseline.setdefault(name, ["untyped", description, {}])
+                    family[1] = description
+                    continue
+
+                if line.startswith("# TYPE "):
+                    name, _, metricType = line[len("# TYPE "):].partition(" ")
+                    family = baseline.setdefault(name, [metricType, "", {}])
+                    family[0] = metricType
+                    continue
+
+                match = SAMPLE_PATTERN.match(line)
+                if line.startswith("#") or match is None or family is None:
+                    continue
+
+                sampleName, labels, value = match.groups()
+                family[2][(sampleName, labels or "")] = float(value)
+
+        self.baseline = {name: (metricType, description, samples)
+                         for name, (metricType, description, samples) in baseline.items()}
+
+
+# A sample line of the text format, e.g. name{label="value"} 1
+SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})?\s+(\S+)$')
+
+# The registry shared by the whole pipeline
+REGISTRY = MetricsRegistry()
+
+
+def getRegistry():
+    """
+    :return: The registry shared by the whole pipeline
+    """
+    return REGISTRY
+
+
+def formatLabels(labelNames, labelValues):
+    """
+    Formats labels for the text format
+
+    :param labelNames: The label names
+    :param labelValues: One value per label name
+    :return: The labels in braces, or an empty string if there are none
+    """
+    if not labelNames:
+        return ""
+
+    pairs = []
+    for name, value in zip(labelNames, labelValues):
+        escaped = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+
+    return "{" + ",".join(pairs) + "}"
+
+
+def formatValue(value):
+    """
+    Formats a sample value, writing whole numbers without a decimal point
+
+    :param value: The value
+    :return: The value as text
+    """
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
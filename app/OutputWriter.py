@@ -13,10 +13,21 @@ class OutputWriter:
     Only responsible for formatting and writing.
     """
 
-    def __init__(self, validRecords, invalidRecords):
+    def __init__(self, validRecords, invalidRecords, pageStats=None, validCount=None):
+        """
+        :param validRecords: The valid records
+        :param invalidRecords: A list of tuples, containing the record and its errors
+        :param pageStats: Page counts from the extractor, if the input had pages
+        :param validCount: The number of valid records, when they aren't passed in. E.g. rendering a report from an ErrorLog
+        """
         self.validRecords = validRecords
         self.invalidRecords = invalidRecords
-        self.totalRecords = len(validRecords) + len(invalidRecords)
+        self.pageStats = pageStats
+        self.validCount = len(validRecords) if validCount is None else validCount
+        self.totalRecords = self.validCount + len(invalidRecords)
+
+        # Every page can fail in isolated mode, leaving no records. The report is still written for the failures
+        self.percentValid = self.validCount / self.totalRecords * 100 if self.totalRecords else 0.0
         self.ruleStats = {}
         self.fieldStats = {}
 
@@ -67,9 +78,29 @@ class OutputWriter:
             f.write("============\n")
             f.write(f"Generated: {datetime.now()}\n")
             f.write(f"Total Records Processed: {self.totalRecords}\n")
-            f.write(f"Valid Records: {self.validRecords}\n")
+            f.write(f"Valid Records: {self.validCount}\n")
             f.write(f"Invalid Records: {len(self.invalidRecords)}\n")
-            f.write(f"Percent of records valid: {len(self.validRecords) / self.totalRecords * 100}%\n\n")
+            f.write(f"Percent of records valid: {self.percentValid}%\n\n")
+
+            if self.pageStats is not None:
+                f.write("Pages\n")
+                f.write("=====\n")
+                f.write(f"Total Pages: {self.pageStats['totalPages']}\n")
+                f.write(f"Pages Extracted: {self.pageStats['extractedPages']}\n")
+                f.write(f"Pages With Tables: {self.pageStats['pagesWithTables']}\n")
+                for reason, count in self.pageStats["skippedPages"].items():
+                    f.write(f"Pages Skipped ({reason}): {count}\n")
+                for reason, count in self.pageStats["failedPages"].items():
+                    f.write(f"Pages Failed ({reason}): {count}\n")
+                f.write("\n")
+
+                # Pages that timed out or crashed, their records are missing from the output
+                if self.pageStats["failures"]:
+                    f.write("Failed Pages\n")
+                    f.write("============\n")
+                    for failure in self.pageStats["failures"]:
+                        f.write(f"Page {failure['page']} ({failure['reason']}): {failure['details']}\n")
+                    f.write("\n")
 
             f.write(f"Validation Issues\n")
             f.write(f"=================\n")
@@ -100,13 +131,16 @@ class OutputWriter:
             "summary": {
                 "timestamp": datetime.now().isoformat(),
                 "totalRecordsProcessed": self.totalRecords,
-                "validRecords": len(self.validRecords),
+                "validRecords": self.validCount,
                 "invalidRecords": len(self.invalidRecords),
-                "percentRecordsValid": len(self.validRecords) / self.totalRecords * 100
+                "percentRecordsValid": self.percentValid
             },
             "validationIssues": self.ruleStats,
             "fieldsWithIssues": self.fieldStats
         }
 
+        if self.pageStats is not None:
+            stats["pages"] = self.pageStats
+
         with open(path, "w") as f:
             json.dump(stats, f, indent=4)
\ No newline at end of file
@@ -1,69 +1,115 @@
-import pdfplumber
-from pdfminer.pdfparser import PDFSyntaxError
-from pdfplumber.utils.exceptions import PdfminerException
+import time
 
 from app.Fields import Fields
+from app.InputSource import InputSource
+from app.Metrics import getRegistry
 from app.PatientRecord import PatientRecord
 
-class PDFExtractor:
+class PDFExtractor(InputSource):
     """
     Extracts patient records from a PDF file
 
     Attributes:
         filePath: Path to the PDF file
+        preflight: If pages are scanned cheaply before running table extraction on them
+        isolated: If pages are extracted in child processes with a time limit
+        pageStats: Page counts from the last extraction, including how many pages were skipped or failed and why
     """
 
-    def __init__(self, filePath):
+    # Reasons the pre-flight scan skips a page
+    # No ruling lines, rectangles or curves, so table extraction has no cell edges to find
+    SKIP_NO_RULINGS = "noRulings"
+
+    # Rulings only run one way, or there are too few to enclose a cell. E.g. signature lines, underlined headings
+    SKIP_NO_GRID = "noGrid"
+
+    # Outcomes of running table extraction on a page
+    PAGE_TABLE = "table"
+    PAGE_NO_TABLE = "noTable"
+
+    # Reasons a page fails in isolated mode
+    # The page took longer than its time limit and the process was stopped
+    FAILED_TIMEOUT = "timeout"
+
+    # The process extracting the page exited without returning a result
+    FAILED_CRASH = "crash"
+
+    # Extracting the page raised an error
+    FAILED_ERROR = "error"
+
+    def __init__(self, filePath, preflight=True, isolated=False, pageTimeout=60, pagesPerChunk=1, workers=1):
         """
         Creates a new PDFExtractor object
 
         :param filePath: Path to the PDF file that contains patient data
+        :param preflight: Skip table extraction on pages that can't contain a table
+        :param isolated: Extract pages in child processes so a page that hangs or crashes only loses that page
+        :param pageTimeout: Seconds each page is given in isolated mode before its process is stopped
+        :param pagesPerChunk: Number of pages each child process extracts in isolated mode
+        :param workers: Number of child processes running at once in isolated mode
         """
 
-        self.filePath = filePath
+        super().__init__(filePath)
+        self.preflight = preflight
+        self.isolated = isolated
+        self.pageTimeout = pageTimeout
+        self.pagesPerChunk = pagesPerChunk
+        self.workers = workers
+
+        # Pages finished so far, whether extracted, skipped or failed
+        self.pagesDone = 0
+
+        metrics = getRegistry()
+        self.pagesCounter = metrics.counter(
+            "dataextractor_pages_total", "Pages processed by the PDF extractor, by outcome", ("status",))
+        self.pageSeconds = metrics.histogram(
+            "dataextractor_page_seconds", "Seconds spent extracting a single page")
 
 
-    def extractRecords(self):
+    def iterRecords(self):
         """
-        Extracts patient records from a PDF file
+        Extracts patient records from a PDF file, one page at a time
 
         Notes:
             Assumes the header can only be in the first row of a table
             Assumes the tables columns are in the order patient id, health card numbers, version code, date of birth, service date
+            In isolated mode, pages that time out, crash or raise an error are recorded in pageStats instead of stopping the extraction
 
-        :return: A list of PatientRecord objects. Each row of the PDF table after the header is converted into a PatientRecord object
+        :return: A generator of PatientRecord objects. Each row of the PDF table after the header is converted into a PatientRecord object
         """
 
-        records = []
-        foundTable = False
+        # pdfplumber and pdfminer are slow to import, so they are only loaded once a PDF is actually read
+        import pdfplumber
+        from pdfminer.pdfparser import PDFSyntaxError
+        from pdfplumber.utils.exceptions import PdfminerException
+
+        self.pagesDone = 0
+        self.pageStats = {
+            "totalPages": 0,
+            "extractedPages": 0,
+            "pagesWithTables": 0,
+            "skippedPages": {},
+            "failedPages": {},
+            "failures": []
+        }
 
         try:
-            with pdfplumber.open(self.filePath) as pdf:
-                for page in pdf.pages:
-                    table = page.extract_table()
-
-                    # Makes sure there is a table
-                    if not table:
-                        continue
-                    else:
-                        foundTable = True
-
-                    # Go through the rows of the table
-                    # Assuming the first row is the column names
-
-                    table = self.removeHeader(table, Fields.getAllFields())
-
-                    for row in table:
-                        if row is None or len(row) != 5:
-                            raise Exception(
-                                f"Incomplete record found in '{self.filePath}' on page {page.page_number}\n"
-                                f"Ensure that all rows are present and have 5 fields"
-                            )
-                        record = PatientRecord(row[0], row[1], row[2], row[3], row[4])
-                        records.append(record)
+            if self.isolated:
+                yield from self.extractIsolated()
+            else:
+                with pdfplumber.open(self.filePath) as pdf:
+                    self.pageStats["totalPages"] = len(pdf.pages)
+
+                    for page in pdf.pages:
+                        started = time.perf_counter()
+                        status, pageRecords = self.extractPage(page)
+                        self.pageSeconds.observe(time.perf_counter() - started)
+                        self.countPage(status)
+                        yield from pageRecords
 
             # Raise an exception if there's no table present
-            if not foundTable:
+            # Pages that failed might have held one, so those are left to the report
+            if not self.pageStats["pagesWithTables"] and not self.pageStats["failures"]:
                 raise Exception(
                     f"The file '{self.filePath}' does not contain any readable tables\n"
                     f"Ensure the PDF has a table present")
@@ -88,25 +134,246 @@ class PDFExtractor:
                 f"Details: {str(e)}"
             )
 
+    def extractPage(self, page):
+        """
+        Extracts the patient records from a single page
+
+        :param page: A pdfplumber page
+        :return: (status, records):
+            status is PAGE_TABLE, PAGE_NO_TABLE, or the reason the pre-flight scan skipped the page
+            records is a list of PatientRecord objects from the page
+        """
+        # Skip the expensive table extraction when the page can't hold a table
+        if self.preflight:
+            reason = self.classifyPage(page)
+            if reason is not None:
+                return reason, []
+
+        table = page.extract_table()
+
+        # Makes sure there is a table
+        if not table:
+            return self.PAGE_NO_TABLE, []
+
+        # Go through the rows of the table
+        # Assuming the first row is the column names
+
+        rowCount = len(table)
+        table = self.removeHeader(table, Fields.getAllFields())
+
+        # Row numbers count the header, so they match the table as it appears on the page
+        firstRowNumber = rowCount - len(table) + 1
+
+        records = []
+        for rowNumber, row in enumerate(table, start=firstRowNumber):
+            if row is None or len(row) != 5:
+                raise Exception(
+                    f"Incomplete record found in '{self.filePath}' on page {page.page_number}\n"
+                    f"Ensure that all rows are present and have 5 fields"
+                )
+            record = PatientRecord(row[0], row[1], row[2], row[3], row[4], page.page_number, rowNumber)
+            records.append(record)
+
+        return self.PAGE_TABLE, records
+
+    def progress(self):
+        """
+        How far the current extraction has got. Safe to call from another thread while extracting
+
+        :return: (done, total) in pages. (None, None) before extraction starts
+        """
+        if self.pageStats is None:
+            return None, None
+
+        return self.pagesDone, self.pageStats["totalPages"]
+
+    def countPage(self, status):
+        """
+        Adds the outcome of a page to pageStats
+
+        :param status: The status returned by extractPage
+        """
+        self.pagesDone += 1
+        self.pagesCounter.labels(status).inc()
+
+        if status in (self.PAGE_TABLE, self.PAGE_NO_TABLE):
+            self.pageStats["extractedPages"] += 1
+            if status == self.PAGE_TABLE:
+                self.pageStats["pagesWithTables"] += 1
+        else:
+            skipped = self.pageStats["skippedPages"]
+            skipped[status] = skipped.get(status, 0) + 1
+
+    def recordFailure(self, pageNumber, reason, details):
+        """
+        Adds a page that failed in isolated mode to pageStats
+
+        :param pageNumber: The page number, starting at 1
+        :param reason: FAILED_TIMEOUT, FAILED_CRASH or FAILED_ERROR
+        :param details: A message describing the failure
+        """
+        self.pagesDone += 1
+        self.pagesCounter.labels(reason).inc()
+
+        failed = self.pageStats["failedPages"]
+        failed[reason] = failed.get(reason, 0) + 1
+        self.pageStats["failures"].append({"page": pageNumber, "reason": reason, "details": details})
+
+    def extractIsolated(self):
+        """
+        Extracts the pages in child processes, each chunk of pages with a wall clock budget
+
+        A chunk that runs past its budget is stopped and its remaining pages are recorded as timed out.
+        A chunk whose process exits early has its remaining pages recorded as crashed.
+        Records from every page that finished are kept
+
+        :return: A list of PatientRecord objects in page order
+        """
+        import multiprocessing
+        from collections import deque
+        from multiprocessing.connection import wait
+
+        import pdfplumber
+
+        # Only the page count is read here, the pages are parsed by the child processes
+        with pdfplumber.open(self.filePath) as pdf:
+            totalPages = len(pdf.pages)
+        self.pageStats["totalPages"] = totalPages
+
+        pageNumbers = list(range(1, totalPages + 1))
+        pending = deque(pageNumbers[i:i + self.pagesPerChunk] for i in range(0, totalPages, self.pagesPerChunk))
+
+        # Receiving end of each running chunk, mapped to [process, pages still to come back, deadline]
+        active = {}
+
+        # Records of each finished page, so the output keeps page order
+        pageRecords = {}
+
+        while pending or active:
+            # Keep the workers busy
+            while pending and len(active) < self.workers:
+                chunk = pending.popleft()
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(
+                    target=extractPagesWorker,
+                    args=(self.filePath, self.preflight, chunk, sender),
+                    daemon=True
+                )
+                process.start()
+
+                # Only the child writes, so the parent sees EOF as soon as the child exits
+                sender.close()
+
+                active[receiver] = [process, list(chunk), time.monotonic() + self.pageTimeout * len(chunk)]
+
+            timeout = max(0, min(entry[2] for entry in active.values()) - time.monotonic())
+
+            for receiver in wait(list(active), timeout):
+                self.readResults(active, receiver, pageRecords)
+
+            # Stop chunks that ran out of time, keeping whatever they already sent
+            now = time.monotonic()
+            for receiver in [r for r, entry in active.items() if entry[2] <= now]:
+                while receiver in active and receiver.poll():
+                    self.readResults(active, receiver, pageRecords)
+
+                if receiver not in active:
+                    continue
+
+                process, remaining, deadline = active.pop(receiver)
+                process.terminate()
+                process.join()
+                receiver.close()
+
+                for pageNumber in remaining:
+                    self.recordFailure(pageNumber, self.FAILED_TIMEOUT,
+                                       f"No result within {self.pageTimeout} seconds per page")
+
+        self.pageStats["failures"].sort(key=lambda failure: failure["page"])
+
+        records = []
+        for pageNumber in sorted(pageRecords):
+            records.extend(pageRecords[pageNumber])
 
         return records
 
-    def removeHeader(self, table, headerData):
+    def readResults(self, active, receiver, pageRecords):
         """
-        Removes a header from a table if the header contains headerData. Assumes the first row of a table is the header.
+        Reads one message from a child process in isolated mode
 
-        :param table: A table to remove the header from
-        :param headerData: The header data to look for
-        :return: A table with the header removed. If no header present, returns table
+        :param active: The running chunks, see extractIsolated
+        :param receiver: The receiving end of the chunk's pipe
+        :param pageRecords: The records of each finished page
         """
-        firstRow = table[0]
-        normalizedRow = [''.join(char.lower() for char in cell if char.isalpha()) for cell in firstRow]
+        process, remaining, deadline = active[receiver]
+
+        try:
+            pageNumber, status, records, error = receiver.recv()
+        except EOFError:
+            # The process exited without sending every page
+            active.pop(receiver)
+            process.join()
+            receiver.close()
+
+            for pageNumber in remaining:
+                self.recordFailure(pageNumber, self.FAILED_CRASH,
+                                   f"The extraction process exited with code {process.exitcode}")
+            return
+
+        remaining.remove(pageNumber)
 
-        if headerData.issubset(normalizedRow):
-            table.pop(0)
-            return table
+        if status == self.FAILED_ERROR:
+            self.recordFailure(pageNumber, self.FAILED_ERROR, error)
         else:
-            return table
+            self.countPage(status)
+            pageRecords[pageNumber] = records
+
+        if not remaining:
+            active.pop(receiver)
+            process.join()
+            receiver.close()
+
+    def classifyPage(self, page):
+        """
+        Cheaply checks if table extraction could find any rows on a page
+
+        Only uses the objects already parsed from the page. Table extraction builds cells from the edges of the
+        ruling lines, rectangles and curves on the page, and every cell needs two horizontal and two vertical edges.
+        A page that can't supply those can never produce a table, so skipping it gives the same result
+
+        :param page: A pdfplumber page
+        :return: None if the page should go through table extraction, otherwise the reason it can be skipped
+        """
+        if not page.lines and not page.rects and not page.curves:
+            return self.SKIP_NO_RULINGS
+
+        if len(page.horizontal_edges) < 2 or len(page.vertical_edges) < 2:
+            return self.SKIP_NO_GRID
+
+        return None
+
+
+def extractPagesWorker(filePath, preflight, pageNumbers, connection):
+    """
+    Extracts a chunk of pages in a child process for PDFExtractor's isolated mode
+
+    Sends (pageNumber, status, records, error) for each page as soon as it is done
+
+    :param filePath: Path to the PDF file
+    :param preflight: Skip table extraction on pages that can't contain a table
+    :param pageNumbers: The page numbers to extract, starting at 1
+    :param connection: The sending end of a pipe back to the parent
+    """
+    import pdfplumber
 
+    extractor = PDFExtractor(filePath, preflight)
 
+    with pdfplumber.open(filePath) as pdf:
+        for pageNumber in pageNumbers:
+            try:
+                status, records = extractor.extractPage(pdf.pages[pageNumber - 1])
+                connection.send((pageNumber, status, records, None))
+            except Exception as e:
+                connection.send((pageNumber, PDFExtractor.FAILED_ERROR, [], str(e)))
 
+    connection.close()
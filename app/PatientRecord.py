@@ -8,10 +8,14 @@ class PatientRecord:
         versionCode: Two letter (uppercase) health card version code
         dateOfBirth: Patient date of birth in YYYY-MM-DD format
         serviceDate: Date the service was provided in YYYY-MM-DD format
+        pageNumber: The page (or worksheet) of the input file the record came from, if known
+        rowNumber: The row of the table (or line of the file) the record came from, if known
     """
-    def __init__(self, patientId, healthCardNumber, versionCode, dateOfBirth, serviceDate):
+    def __init__(self, patientId, healthCardNumber, versionCode, dateOfBirth, serviceDate, pageNumber=None, rowNumber=None):
         self.patientId = patientId
         self.healthCardNumber = healthCardNumber
         self.versionCode = versionCode
         self.dateOfBirth = dateOfBirth
         self.serviceDate = serviceDate
+        self.pageNumber = pageNumber
+        self.rowNumber = rowNumber
@@ -1,4 +1,10 @@
 
+import time
+from collections import deque
+
+from app.Metrics import getRegistry
+
+
 class RecordProcessor:
     """
 
@@ -6,35 +12,129 @@ class RecordProcessor:
 
     Steps:
         1. The records are retrieved from the extractor
-        2. The records are validated with the validator
+        2. The records are validated with the validator, in chunks on a thread pool when workers is more than 1
         3. The records are separated into valid and invalid groups
+        4. Valid records that repeat another record are moved to the invalid group, if a duplicate detector is given
 
     Attributes:
-        extractor: Responsible for reading records from the input source
+        extractor: The InputSource the records are read from
         validator: Responsible for validating the records
+        duplicateDetector: Finds valid records that repeat another record. Optional
+        workers: Number of threads validating records. 1 validates in the calling thread
+        chunkSize: Number of records handed to a thread at a time
         validRecords: A list of the records that pass validation
         invalidRecords: A list of tuples, containing the record and its associated error
     """
-    def __init__(self, extractor, validator):
+    def __init__(self, extractor, validator, duplicateDetector=None, workers=1, chunkSize=1000):
         self.extractor = extractor
         self.validator = validator
+        self.duplicateDetector = duplicateDetector
+        self.workers = workers
+        self.chunkSize = chunkSize
         self.validRecords = []
         self.invalidRecords = []
 
+        metrics = getRegistry()
+        recordsCounter = metrics.counter(
+            "dataextractor_records_total", "Records processed, by validation result", ("result",))
+        self.validCounter = recordsCounter.labels("valid")
+        self.invalidCounter = recordsCounter.labels("invalid")
+        self.processSeconds = metrics.histogram(
+            "dataextractor_process_seconds", "Seconds spent extracting and validating a whole input file")
+
     '''
     Extracts the records, validates them, and populates the valid and invalid lists
     '''
     def process(self):
-        # Extracting the records from the PDF into records
-        records = self.extractor.extractRecords()
-
-
-        for record in records:
-            # valid: boolean, if the record is valid
-            # errors: list of issues with the record
-            valid, errors = self.validator.validate(record)
+        started = time.perf_counter()
 
+        # Records are streamed from the input source and validated as they arrive
+        # valid: boolean, if the record is valid
+        # errors: list of issues with the record
+        for record, (valid, errors) in self.validateRecords():
             if valid:
                 self.validRecords.append(record)
+                # With a duplicate detector, valid records are only counted once duplicates are removed
+                if self.duplicateDetector is None:
+                    self.validCounter.inc()
             else:
-                self.invalidRecords.append((record, errors))
\ No newline at end of file
+                self.invalidRecords.append((record, errors))
+                self.invalidCounter.inc()
+
+        if self.duplicateDetector is not None:
+            self.flagDuplicates()
+
+        self.processSeconds.observe(time.perf_counter() - started)
+
+    '''
+    Moves the valid records that repeat another record to the invalid list, with their duplicate errors
+    '''
+    def flagDuplicates(self):
+        duplicates = self.duplicateDetector.findDuplicates(self.validRecords)
+
+        if duplicates:
+            validRecords = []
+            for position, record in enumerate(self.validRecords):
+                if position in duplicates:
+                    self.invalidRecords.append((record, duplicates[position]))
+                    self.invalidCounter.inc()
+                else:
+                    validRecords.append(record)
+
+            self.validRecords = validRecords
+
+        self.validCounter.inc(len(self.validRecords))
+
+    '''
+    Validates the records from the extractor, in the order they are read
+    Yields (record, (valid, errors)) tuples
+    '''
+    def validateRecords(self):
+        if self.workers <= 1:
+            for record in self.extractor.iterRecords():
+                yield record, self.validator.validate(record)
+            return
+
+        # Only imported when threads are used, it adds to the start up time
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Chunks are handed out in order and their results read back in the same order,
+        # so the lists come out exactly as they would from the serial loop.
+        # A few chunks per thread are kept in flight so extraction doesn't run ahead of validation
+        pending = deque()
+        maxPending = self.workers * 2
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for chunk in self.chunks():
+                pending.append((chunk, executor.submit(self.validateChunk, chunk)))
+
+                if len(pending) >= maxPending:
+                    chunk, future = pending.popleft()
+                    yield from zip(chunk, future.result())
+
+            while pending:
+                chunk, future = pending.popleft()
+                yield from zip(chunk, future.result())
+
+    '''
+    Splits the records from the extractor into lists of chunkSize records
+    '''
+    def chunks(self):
+        chunk = []
+
+        for record in self.extractor.iterRecords():
+            chunk.append(record)
+
+            if len(chunk) >= self.chunkSize:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    '''
+    Validates a chunk of records on a worker thread
+    Returns a list of (valid, errors) tuples in the order of the chunk
+    '''
+    def validateChunk(self, chunk):
+        return [self.validator.validate(record) for record in chunk]
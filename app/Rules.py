@@ -22,12 +22,17 @@ class Rules:
     # E.g. Wrong number of fields, missing columns, malformed data
     STRUCTURE = "structure"
 
+    # The record repeats another record, in the same run or already in the database
+    # E.g. a health card number used by two patients, the same claim submitted twice
+    DUPLICATE = "duplicate"
+
     DISPLAY_NAME = {
         MISSING: "Missing Field",
         INVALID: "Invalid Field",
         RANGE: "Value Outside Range",
         TYPE: "Type",
-        STRUCTURE: "Structure"
+        STRUCTURE: "Structure",
+        DUPLICATE: "Duplicate"
     }
 
     @classmethod
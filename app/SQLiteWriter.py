@@ -1,17 +1,33 @@
+import hashlib
 import sqlite3
+import time
+
+from app.Metrics import getRegistry
 
 class SQLiteWriter:
     """
     Handles saving valid patient records into a SQLite database.
     """
 
+    # Number of ids looked up per query when checking which records already exist
+    LOOKUP_BATCH_SIZE = 500
+
+    # Columns returned by the query API, in the same order as the CSV output
+    COLUMNS = ["patientId", "healthCardNumber", "versionCode", "dateOfBirth", "serviceDate"]
+
     def __init__(self, dbPath):
         self.dbPath = dbPath
         self.createTable()
 
+        metrics = getRegistry()
+        self.writeSeconds = metrics.histogram(
+            "dataextractor_sqlite_write_seconds", "Seconds spent writing a batch of records to SQLite", ("operation",))
+        self.rowsCounter = metrics.counter(
+            "dataextractor_sqlite_rows_total", "Records written to SQLite, by outcome", ("result",))
+
     def createTable(self):
         """
-        Creates the table if it doesn't exist
+        Creates the tables if they don't exist
         """
 
         connection = sqlite3.connect(self.dbPath)
@@ -23,7 +39,71 @@ class SQLiteWriter:
                 healthCardNumber TEXT,
                 versionCode TEXT,
                 dateOfBirth TEXT,
-                serviceDate TEXT
+                serviceDate TEXT,
+                contentHash TEXT
+            )
+        ''')
+
+        # Databases created before content hashes were stored
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(patientRecords)')]
+        if "contentHash" not in columns:
+            cursor.execute('ALTER TABLE patientRecords ADD COLUMN contentHash TEXT')
+
+        # Secondary indexes for the query API
+        # patientId is included so pages filtered by health card come back in key order without a sort
+        cursor.execute('CREATE INDEX IF NOT EXISTS idxPatientRecordsHealthCardNumber ON patientRecords (healthCardNumber, patientId)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idxPatientRecordsServiceDate ON patientRecords (serviceDate)')
+
+        # History of every run and the issue counts it found
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS runs (
+                runId INTEGER PRIMARY KEY AUTOINCREMENT,
+                inputFile TEXT,
+                startedAt TEXT,
+                finishedAt TEXT,
+                processingSeconds REAL,
+                durationSeconds REAL,
+                totalRecords INTEGER,
+                validRecords INTEGER,
+                invalidRecords INTEGER
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idxRunsStartedAt ON runs (startedAt)')
+
+        # kind is rule or field, name is the rule or field identifier
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS run_stats (
+                runId INTEGER REFERENCES runs (runId),
+                kind TEXT,
+                name TEXT,
+                count INTEGER,
+                PRIMARY KEY (runId, kind, name)
+            )
+        ''')
+
+        # Totals per day and per month, kept up to date as each run is recorded
+        # period is day or month, periodStart is the YYYY-MM-DD the period starts on
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS run_rollups (
+                period TEXT,
+                periodStart TEXT,
+                runs INTEGER,
+                processingSeconds REAL,
+                durationSeconds REAL,
+                totalRecords INTEGER,
+                validRecords INTEGER,
+                invalidRecords INTEGER,
+                PRIMARY KEY (period, periodStart)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS run_stat_rollups (
+                period TEXT,
+                periodStart TEXT,
+                kind TEXT,
+                name TEXT,
+                count INTEGER,
+                PRIMARY KEY (period, periodStart, kind, name)
             )
         ''')
 
@@ -42,15 +122,9 @@ class SQLiteWriter:
 
         cursor.execute('''
             INSERT OR REPLACE INTO patientRecords
-            (patientId, healthCardNumber, versionCode, dateOfBirth, serviceDate)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            record.patientId,
-            record.healthCardNumber,
-            record.versionCode,
-            record.dateOfBirth,
-            record.serviceDate
-        ))
+            (patientId, healthCardNumber, versionCode, dateOfBirth, serviceDate, contentHash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', self.toRow(record))
 
         connection.commit()
         connection.close()
@@ -63,27 +137,135 @@ class SQLiteWriter:
         if not records:
             return
 
+        started = time.perf_counter()
         connection = sqlite3.connect(self.dbPath)
-        cursor = connection.cursor()
 
-        cursor.executemany('''
+        self.insertRows(connection, [self.toRow(record) for record in records])
+
+        connection.commit()
+        connection.close()
+
+        self.writeSeconds.labels("insert").observe(time.perf_counter() - started)
+
+    def insertRows(self, connection, rows):
+        """
+        Inserts or replaces rows on an open connection, without committing
+
+        :param connection: The connection to write with
+        :param rows: Rows from toRow
+        """
+        connection.executemany('''
             INSERT OR REPLACE INTO patientRecords
-            (patientId, healthCardNumber, versionCode, dateOfBirth, serviceDate)
-            VALUES (?, ?, ?, ?, ?)
-        ''', [
-            (
-                record.patientId,
-                record.healthCardNumber,
-                record.versionCode,
-                record.dateOfBirth,
-                record.serviceDate
-            )
-            for record in records
-        ])
+            (patientId, healthCardNumber, versionCode, dateOfBirth, serviceDate, contentHash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+        self.rowsCounter.labels("replaced").inc(len(rows))
+
+    def upsertRecords(self, records):
+        """
+        Insert new records and update changed ones, leaving unchanged rows untouched
+
+        Each row stores a hash of its content. A record whose hash matches the stored row is skipped by SQLite,
+        so re-running mostly unchanged data writes close to nothing
+
+        :param records: The records to upsert into the database
+        :return: A dictionary with the number of rows inserted, updated and unchanged
+        """
+        if not records:
+            return {"inserted": 0, "updated": 0, "unchanged": 0}
+
+        started = time.perf_counter()
+        connection = sqlite3.connect(self.dbPath)
+
+        counts = self.upsertRows(connection, [self.toRow(record) for record in records])
 
         connection.commit()
         connection.close()
 
+        self.writeSeconds.labels("upsert").observe(time.perf_counter() - started)
+
+        return counts
+
+    def upsertRows(self, connection, rows):
+        """
+        Upserts rows on an open connection, without committing
+
+        :param connection: The connection to write with
+        :param rows: Rows from toRow
+        :return: A dictionary with the number of rows inserted, updated and unchanged
+        """
+        cursor = connection.cursor()
+
+        # Which ids are already stored, to tell inserts apart from updates
+        existing = set()
+        ids = list({row[0] for row in rows})
+        for start in range(0, len(ids), self.LOOKUP_BATCH_SIZE):
+            batch = ids[start:start + self.LOOKUP_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            cursor.execute(f'SELECT patientId FROM patientRecords WHERE patientId IN ({placeholders})', batch)
+            existing.update(row[0] for row in cursor.fetchall())
+
+        changesBefore = connection.total_changes
+
+        cursor.executemany('''
+            INSERT INTO patientRecords
+            (patientId, healthCardNumber, versionCode, dateOfBirth, serviceDate, contentHash)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(patientId) DO UPDATE SET
+                healthCardNumber = excluded.healthCardNumber,
+                versionCode = excluded.versionCode,
+                dateOfBirth = excluded.dateOfBirth,
+                serviceDate = excluded.serviceDate,
+                contentHash = excluded.contentHash
+            WHERE patientRecords.contentHash IS NOT excluded.contentHash
+        ''', rows)
+
+        changes = connection.total_changes - changesBefore
+
+        # Ids seen for the first time are inserts, every other change is an update
+        inserted = len(ids) - len(existing)
+        counts = {
+            "inserted": inserted,
+            "updated": changes - inserted,
+            "unchanged": len(rows) - changes
+        }
+
+        for result, count in counts.items():
+            self.rowsCounter.labels(result).inc(count)
+
+        return counts
+
+    @classmethod
+    def toRow(cls, record):
+        """
+        Converts a record to the column values stored in the database
+
+        :param record: The PatientRecord object
+        :return: A tuple of the column values, ending with the content hash
+        """
+        values = (
+            record.patientId,
+            record.healthCardNumber,
+            record.versionCode,
+            record.dateOfBirth,
+            record.serviceDate
+        )
+
+        return values + (cls.contentHash(values),)
+
+    @classmethod
+    def contentHash(cls, values):
+        """
+        Hashes the column values of a record
+
+        :param values: The column values of a record
+        :return: A hex digest that changes when any of the values change
+        """
+        # Unit separator between values so ("ab", "c") and ("a", "bc") hash differently
+        content = "\x1f".join("" if value is None else str(value) for value in values)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
     def fetchAll(self):
         """
         Returns all records from the database
@@ -96,4 +278,275 @@ class SQLiteWriter:
         rows = cursor.fetchall()
 
         connection.close()
-        return rows
\ No newline at end of file
+        return rows
+
+    def recordRun(self, inputFile, startedAt, finishedAt, processingSeconds, totalRecords, validRecords,
+                  invalidRecords, ruleStats, fieldStats):
+        """
+        Saves the statistics of a run and adds them to the daily and monthly rollups
+
+        Everything is written in one transaction so the rollups always match the runs table
+
+        :param inputFile: Path to the file that was processed
+        :param startedAt: datetime the run started
+        :param finishedAt: datetime the run finished
+        :param processingSeconds: Seconds spent extracting and validating
+        :param totalRecords: Number of records processed
+        :param validRecords: Number of valid records
+        :param invalidRecords: Number of invalid records
+        :param ruleStats: Number of errors for each rule
+        :param fieldStats: Number of errors for each field
+        :return: The id of the new run
+        """
+        connection = sqlite3.connect(self.dbPath)
+
+        runId = self.saveRun(connection, inputFile, startedAt, finishedAt, processingSeconds, totalRecords,
+                             validRecords, invalidRecords, ruleStats, fieldStats)
+
+        connection.commit()
+        connection.close()
+
+        return runId
+
+    def saveRun(self, connection, inputFile, startedAt, finishedAt, processingSeconds, totalRecords, validRecords,
+                invalidRecords, ruleStats, fieldStats):
+        """
+        Saves the statistics of a run and updates the rollups on an open connection, without committing
+
+        :param connection: The connection to write with
+        The other parameters are the same as recordRun
+        :return: The id of the new run
+        """
+        durationSeconds = (finishedAt - startedAt).total_seconds()
+        stats = [("rule", name, count) for name, count in ruleStats.items()]
+        stats += [("field", name, count) for name, count in fieldStats.items()]
+
+        # The day and month the run falls in
+        periods = [
+            ("day", startedAt.strftime("%Y-%m-%d")),
+            ("month", startedAt.strftime("%Y-%m-01"))
+        ]
+
+        cursor = connection.cursor()
+
+        cursor.execute('''
+            INSERT INTO runs
+            (inputFile, startedAt, finishedAt, processingSeconds, durationSeconds, totalRecords, validRecords, invalidRecords)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            inputFile,
+            startedAt.isoformat(),
+            finishedAt.isoformat(),
+            processingSeconds,
+            durationSeconds,
+            totalRecords,
+            validRecords,
+            invalidRecords
+        ))
+        runId = cursor.lastrowid
+
+        cursor.executemany(
+            'INSERT INTO run_stats (runId, kind, name, count) VALUES (?, ?, ?, ?)',
+            [(runId, kind, name, count) for kind, name, count in stats]
+        )
+
+        cursor.executemany('''
+            INSERT INTO run_rollups
+            (period, periodStart, runs, processingSeconds, durationSeconds, totalRecords, validRecords, invalidRecords)
+            VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+            ON CONFLICT(period, periodStart) DO UPDATE SET
+                runs = runs + 1,
+                processingSeconds = processingSeconds + excluded.processingSeconds,
+                durationSeconds = durationSeconds + excluded.durationSeconds,
+                totalRecords = totalRecords + excluded.totalRecords,
+                validRecords = validRecords + excluded.validRecords,
+                invalidRecords = invalidRecords + excluded.invalidRecords
+        ''', [
+            (period, periodStart, processingSeconds, durationSeconds, totalRecords, validRecords, invalidRecords)
+            for period, periodStart in periods
+        ])
+
+        cursor.executemany('''
+            INSERT INTO run_stat_rollups (period, periodStart, kind, name, count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(period, periodStart, kind, name) DO UPDATE SET
+                count = count + excluded.count
+        ''', [
+            (period, periodStart, kind, name, count)
+            for period, periodStart in periods
+            for kind, name, count in stats
+        ])
+
+        return runId
+
+    def fetchRuns(self, limit=100):
+        """
+        Returns the most recent runs
+
+        :param limit: The maximum number of runs to return
+        :return: A list of dictionaries, newest run first
+        """
+        connection = sqlite3.connect(self.dbPath)
+        connection.row_factory = sqlite3.Row
+        cursor = connection.cursor()
+
+        cursor.execute('SELECT * FROM runs ORDER BY runId DESC LIMIT ?', (limit,))
+        rows = [dict(row) for row in cursor.fetchall()]
+
+        connection.close()
+        return rows
+
+    def fetchRollups(self, period, periodFrom=None, periodTo=None):
+        """
+        Returns the run totals for each day or month, along with their rule and field counts
+
+        :param period: day or month
+        :param periodFrom: Only periods starting on or after this YYYY-MM-DD date
+        :param periodTo: Only periods starting on or before this YYYY-MM-DD date
+        :return: A list of dictionaries in date order. ruleStats and fieldStats hold the error counts of the period
+        """
+        conditions = ["period = ?"]
+        params = [period]
+
+        if periodFrom is not None:
+            conditions.append("periodStart >= ?")
+            params.append(periodFrom)
+
+        if periodTo is not None:
+            conditions.append("periodStart <= ?")
+            params.append(periodTo)
+
+        where = " AND ".join(conditions)
+
+        connection = sqlite3.connect(self.dbPath)
+        connection.row_factory = sqlite3.Row
+        cursor = connection.cursor()
+
+        cursor.execute(f'SELECT * FROM run_rollups WHERE {where} ORDER BY periodStart', params)
+        rollups = {row["periodStart"]: dict(row, ruleStats={}, fieldStats={}) for row in cursor.fetchall()}
+
+        cursor.execute(f'SELECT periodStart, kind, name, count FROM run_stat_rollups WHERE {where}', params)
+        for row in cursor.fetchall():
+            rollup = rollups.get(row["periodStart"])
+            if rollup is not None:
+                rollup[f"{row['kind']}Stats"][row["name"]] = row["count"]
+
+        connection.close()
+        return list(rollups.values())
+
+    def queryRecords(self, healthCardNumber=None, versionCode=None, serviceDateFrom=None, serviceDateTo=None,
+                     afterPatientId=None, limit=100):
+        """
+        Returns one page of records matching the filters, ordered by patient id
+
+        Uses keyset pagination. Pass the patient id of the last row of a page as afterPatientId to get the next page,
+        so every page costs the same no matter how deep it is
+
+        :param healthCardNumber: Only records with this health card number
+        :param versionCode: Only records with this version code
+        :param serviceDateFrom: Only records with a service date on or after this YYYY-MM-DD date
+        :param serviceDateTo: Only records with a service date on or before this YYYY-MM-DD date
+        :param afterPatientId: Only records with a patient id after this one
+        :param limit: The maximum number of records to return
+        :return: A list of (patientId, healthCardNumber, versionCode, dateOfBirth, serviceDate) tuples
+        """
+        where, params = self.buildFilters(healthCardNumber, versionCode, serviceDateFrom, serviceDateTo, afterPatientId)
+
+        connection = sqlite3.connect(self.dbPath)
+        cursor = connection.cursor()
+
+        cursor.execute(
+            f'SELECT {", ".join(self.COLUMNS)} FROM patientRecords {where} ORDER BY patientId LIMIT ?',
+            params + [limit]
+        )
+        rows = cursor.fetchall()
+
+        connection.close()
+        return rows
+
+    def iterRecords(self, healthCardNumber=None, versionCode=None, serviceDateFrom=None, serviceDateTo=None,
+                    batchSize=1000):
+        """
+        Streams every record matching the filters, ordered by patient id, without loading them all into memory
+
+        :param healthCardNumber: Only records with this health card number
+        :param versionCode: Only records with this version code
+        :param serviceDateFrom: Only records with a service date on or after this YYYY-MM-DD date
+        :param serviceDateTo: Only records with a service date on or before this YYYY-MM-DD date
+        :param batchSize: The number of rows fetched from SQLite at a time
+        :return: A generator of (patientId, healthCardNumber, versionCode, dateOfBirth, serviceDate) tuples
+        """
+        where, params = self.buildFilters(healthCardNumber, versionCode, serviceDateFrom, serviceDateTo)
+
+        connection = sqlite3.connect(self.dbPath)
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(f'SELECT {", ".join(self.COLUMNS)} FROM patientRecords {where} ORDER BY patientId', params)
+
+            while True:
+                rows = cursor.fetchmany(batchSize)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            connection.close()
+
+    def countRecords(self, healthCardNumber=None, versionCode=None, serviceDateFrom=None, serviceDateTo=None):
+        """
+        Counts the records matching the filters
+
+        :param healthCardNumber: Only records with this health card number
+        :param versionCode: Only records with this version code
+        :param serviceDateFrom: Only records with a service date on or after this YYYY-MM-DD date
+        :param serviceDateTo: Only records with a service date on or before this YYYY-MM-DD date
+        :return: The number of matching records
+        """
+        where, params = self.buildFilters(healthCardNumber, versionCode, serviceDateFrom, serviceDateTo)
+
+        connection = sqlite3.connect(self.dbPath)
+        cursor = connection.cursor()
+
+        cursor.execute(f'SELECT COUNT(*) FROM patientRecords {where}', params)
+        count = cursor.fetchone()[0]
+
+        connection.close()
+        return count
+
+    def buildFilters(self, healthCardNumber=None, versionCode=None, serviceDateFrom=None, serviceDateTo=None,
+                     afterPatientId=None):
+        """
+        Builds the WHERE clause for the query API
+
+        :return: (where, params):
+            where is the WHERE clause, or an empty string if there are no filters
+            params is the list of values for the placeholders in the clause
+        """
+        conditions = []
+        params = []
+
+        if healthCardNumber is not None:
+            conditions.append("healthCardNumber = ?")
+            params.append(healthCardNumber)
+
+        if versionCode is not None:
+            conditions.append("versionCode = ?")
+            params.append(versionCode)
+
+        # Dates are stored as YYYY-MM-DD so text comparison matches date order
+        if serviceDateFrom is not None:
+            conditions.append("serviceDate >= ?")
+            params.append(serviceDateFrom)
+
+        if serviceDateTo is not None:
+            conditions.append("serviceDate <= ?")
+            params.append(serviceDateTo)
+
+        if afterPatientId is not None:
+            conditions.append("patientId > ?")
+            params.append(afterPatientId)
+
+        if not conditions:
+            return "", params
+
+        return "WHERE " + " AND ".join(conditions), params
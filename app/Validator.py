@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 
 from app.Fields import Fields
+from app.Metrics import getRegistry
 from app.Rules import Rules
 from app.ValidationError import ValidationError
 
@@ -10,6 +11,10 @@ class Validator:
     Validates PatientRecord objects and their attributes
 
     """
+    def __init__(self):
+        self.failuresCounter = getRegistry().counter(
+            "dataextractor_validation_failures_total", "Validation errors found, by rule and field", ("rule", "field"))
+
     def validate(self, record):
         """
         Validates an entire PatientRecord
@@ -26,6 +31,9 @@ class Validator:
         errors.extend(self.validateDateOfBirth(record.dateOfBirth))
         errors.extend(self.validateServiceDate(record.serviceDate, record.dateOfBirth))
 
+        for error in errors:
+            self.failuresCounter.labels(error.rule, error.field).inc()
+
         return (len(errors) == 0), errors
 
     def validateHealthCardNumber(self, healthCardNumber):
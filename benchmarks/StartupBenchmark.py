@@ -0,0 +1,106 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+# Root of the repository, used as the working directory for the child interpreter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be loaded just by importing the CLI entry point
+HEAVY_MODULES = ["pdfplumber", "pdfminer", "pandas", "plotly", "streamlit", "pyarrow", "numpy", "openpyxl"]
+
+# Default import time budget for the CLI entry point in milliseconds
+DEFAULT_BUDGET_MS = 50.0
+
+
+def measureImportTime(moduleName, runs=5):
+    """
+    Measures the time it takes to import a module in a fresh interpreter using python -X importtime
+
+    :param moduleName: The module to import
+    :param runs: The number of fresh interpreters to measure. The fastest run is kept to reduce noise
+
+    Bytecode is cached in a temporary directory and a first, unmeasured import fills the cache,
+    so the time is the start up an installed CLI sees rather than compiling every module.
+    PYTHONDONTWRITEBYTECODE would otherwise make each run recompile the whole package
+    :return: (milliseconds, modules):
+        milliseconds is the cumulative import time of the module
+        modules is the set of top level packages that were imported along with it
+    """
+    best = None
+    modules = set()
+
+    cacheDirectory = tempfile.TemporaryDirectory()
+    environment = dict(os.environ)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    environment["PYTHONPYCACHEPREFIX"] = cacheDirectory.name
+
+    # Fills the bytecode cache
+    subprocess.run([sys.executable, "-c", f"import {moduleName}"], cwd=ROOT, env=environment, capture_output=True)
+
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {moduleName}"],
+            cwd=ROOT,
+            env=environment,
+            capture_output=True,
+            text=True
+        )
+
+        if result.returncode != 0:
+            raise Exception(
+                f"Importing '{moduleName}' failed\n"
+                f"Details: {result.stderr.strip()}")
+
+        cumulative = None
+        modules = set()
+
+        # Lines look like "import time:       123 |        456 |   package.module"
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+
+            parts = line[len("import time:"):].split("|")
+            if len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+
+            name = parts[2].strip()
+            modules.add(name.split(".")[0])
+
+            if name == moduleName:
+                cumulative = int(parts[1]) / 1000
+
+        if cumulative is None:
+            raise Exception(f"No import time was reported for '{moduleName}'")
+
+        if best is None or cumulative < best:
+            best = cumulative
+
+    cacheDirectory.cleanup()
+
+    return best, modules
+
+
+if __name__ == "__main__":
+    # Optional budget in milliseconds
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+
+    milliseconds, modules = measureImportTime("App")
+    heavy = [name for name in HEAVY_MODULES if name in modules]
+
+    print(f"Import time for App: {milliseconds:.1f} ms (budget {budget:.1f} ms)")
+
+    failed = False
+
+    if heavy:
+        print(f"Heavy modules loaded at start up: {', '.join(heavy)}")
+        failed = True
+
+    if milliseconds > budget:
+        print("Import time budget exceeded")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+    print("Within budget.")
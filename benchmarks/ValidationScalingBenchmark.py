@@ -0,0 +1,126 @@
+import os
+import random
+import sys
+import sysconfig
+import time
+from datetime import date, timedelta
+
+# Lets the benchmark be run from any directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.InputSource import InputSource
+from app.PatientRecord import PatientRecord
+from app.RecordProcessor import RecordProcessor
+from app.Validator import Validator
+
+# Default number of generated records
+DEFAULT_RECORDS = 200000
+
+# Default highest number of threads measured
+DEFAULT_MAX_WORKERS = os.cpu_count() or 4
+
+
+class GeneratedSource(InputSource):
+    """
+    Input source of generated records, so the benchmark measures validation rather than file reading
+    """
+
+    def __init__(self, records):
+        super().__init__(None)
+        self.records = records
+
+    def iterRecords(self):
+        yield from self.records
+
+
+def generateRecords(count, seed=1):
+    """
+    Generates a mix of valid and invalid records
+
+    :param count: The number of records
+    :param seed: Seed for the random generator, so every run validates the same records
+    :return: A list of PatientRecord objects
+    """
+    generator = random.Random(seed)
+    today = date.today()
+    records = []
+
+    for i in range(count):
+        healthCardNumber = str(generator.randrange(10 ** 9, 10 ** 10))
+        versionCode = generator.choice(["AB", "CD", "ZZ", "A1", ""])
+        dateOfBirth = (today - timedelta(days=generator.randrange(365, 36500))).isoformat()
+        serviceDate = (today - timedelta(days=generator.randrange(0, 365))).isoformat()
+
+        # Some records get malformed dates
+        if generator.random() < 0.05:
+            serviceDate = serviceDate.replace("-", "/")
+
+        records.append(PatientRecord(f"P{i:07d}", healthCardNumber, versionCode, dateOfBirth, serviceDate))
+
+    return records
+
+
+def runProcessor(records, workers, chunkSize):
+    """
+    Validates the records with a RecordProcessor
+
+    :param records: The PatientRecord objects
+    :param workers: Number of validation threads
+    :param chunkSize: Number of records handed to a thread at a time
+    :return: (seconds, processor)
+    """
+    processor = RecordProcessor(GeneratedSource(records), Validator(), workers=workers, chunkSize=chunkSize)
+
+    started = time.perf_counter()
+    processor.process()
+
+    return time.perf_counter() - started, processor
+
+
+def summarize(processor):
+    """
+    Reduces the processor's lists to plain values that can be compared between runs
+
+    :param processor: A RecordProcessor that has run
+    :return: (valid patient ids, invalid patient ids with their errors)
+    """
+    valid = [record.patientId for record in processor.validRecords]
+    invalid = [(record.patientId, [error.toDictionary() for error in errors])
+               for record, errors in processor.invalidRecords]
+
+    return valid, invalid
+
+
+if __name__ == "__main__":
+    # Optional record count and highest number of threads
+    recordCount = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RECORDS
+    maxWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MAX_WORKERS
+    chunkSize = 1000
+
+    gilDisabled = bool(sysconfig.get_config_var("Py_GIL_DISABLED"))
+    print(f"Python {sys.version.split()[0]}, free-threaded build: {'yes' if gilDisabled else 'no'}")
+    print(f"Validating {recordCount} records in chunks of {chunkSize}")
+
+    records = generateRecords(recordCount)
+
+    serialSeconds, serialProcessor = runProcessor(records, 1, chunkSize)
+    expected = summarize(serialProcessor)
+
+    print(f"{'Threads':>7} {'Seconds':>9} {'Records/s':>11} {'Speedup':>8}")
+    print(f"{1:>7} {serialSeconds:>9.3f} {recordCount / serialSeconds:>11.0f} {1.0:>8.2f}")
+
+    failed = False
+
+    for workers in range(2, maxWorkers + 1):
+        seconds, processor = runProcessor(records, workers, chunkSize)
+        print(f"{workers:>7} {seconds:>9.3f} {recordCount / seconds:>11.0f} {serialSeconds / seconds:>8.2f}")
+
+        if summarize(processor) != expected:
+            print(f"Results with {workers} threads don't match the serial run")
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+    print("Results match the serial run.")
@@ -0,0 +1,160 @@
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import Future
+from datetime import date, timedelta
+
+# Lets the tests be run from any directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from App import App
+from app.BatchWriter import BatchWriter
+from app.PatientRecord import PatientRecord
+
+PRODUCERS = 6
+BATCHES = 20
+BATCH_SIZE = 50
+
+
+def makeBatch(producer, batch):
+    """
+    :return: A batch of records with ids unique to the producer and batch
+    """
+    return [PatientRecord(f"P{producer}-{batch}-{i}", "1234567897", "AB", "1980-01-01", "2026-01-01")
+            for i in range(BATCH_SIZE)]
+
+
+def produceInProcess(batchQueue, producer):
+    """
+    Producer run in a child process, submitting through the shared queue
+    """
+    for batch in range(BATCHES):
+        BatchWriter.submitTo(batchQueue, makeBatch(producer, batch))
+
+
+def countRows(dbPath, table="patientRecords"):
+    connection = sqlite3.connect(dbPath)
+    count = connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    connection.close()
+    return count
+
+
+class BatchWriterTest(unittest.TestCase):
+    """
+    Many producers writing to one database through a single BatchWriter
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.dbPath = os.path.join(self.directory, "shared.db")
+
+    def testThreadProducers(self):
+        writer = BatchWriter(self.dbPath, maxQueuedBatches=4, commitRows=500, commitSeconds=0.05)
+        writer.start()
+
+        futures = []
+        lock = threading.Lock()
+
+        def produce(producer):
+            for batch in range(BATCHES):
+                future = writer.submit(makeBatch(producer, batch))
+                with lock:
+                    futures.append(future)
+
+            # A batch submitted twice must not duplicate rows
+            future = writer.submit(makeBatch(producer, 0))
+            with lock:
+                futures.append(future)
+
+        threads = [threading.Thread(target=produce, args=(producer,)) for producer in range(PRODUCERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        writer.close()
+
+        for future in futures:
+            future.result()
+
+        self.assertEqual(countRows(self.dbPath), PRODUCERS * BATCHES * BATCH_SIZE)
+        self.assertEqual(writer.counts["inserted"], PRODUCERS * BATCHES * BATCH_SIZE)
+        self.assertEqual(writer.counts["unchanged"], PRODUCERS * BATCH_SIZE)
+
+    def testProcessProducers(self):
+        batchQueue = BatchWriter.createProcessQueue(4)
+        writer = BatchWriter(self.dbPath, batchQueue=batchQueue, commitRows=500, commitSeconds=0.05)
+        writer.start()
+
+        processes = [multiprocessing.Process(target=produceInProcess, args=(batchQueue, producer))
+                     for producer in range(PRODUCERS)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        writer.close()
+
+        self.assertEqual(countRows(self.dbPath), PRODUCERS * BATCHES * BATCH_SIZE)
+        self.assertEqual(writer.rowsWritten, PRODUCERS * BATCHES * BATCH_SIZE)
+
+    def testFailingBatchKeepsOtherProducersRows(self):
+        # Long enough that every batch below lands in the same commit
+        writer = BatchWriter(self.dbPath, commitRows=100000, commitSeconds=1.0)
+        writer.start()
+
+        first = writer.submit(makeBatch(0, 0))
+
+        # A row with a missing column makes the write fail inside the writer
+        failing = Future()
+        writer.queue.put((BatchWriter.ROWS, [("broken",)], failing))
+
+        second = writer.submit(makeBatch(2, 0))
+
+        with self.assertRaises(Exception):
+            writer.close()
+
+        with self.assertRaises(sqlite3.Error):
+            failing.result()
+
+        self.assertEqual(first.result()["inserted"], BATCH_SIZE)
+        self.assertEqual(second.result()["inserted"], BATCH_SIZE)
+        self.assertEqual(writer.failedBatches, 1)
+        self.assertEqual(countRows(self.dbPath), 2 * BATCH_SIZE)
+
+    def testRunIsNotSavedWhenRowsFail(self):
+        serviceDate = (date.today() - timedelta(days=10)).isoformat()
+        inputPath = os.path.join(self.directory, "records.csv")
+        with open(inputPath, "w") as f:
+            f.write("patientId,healthCardNumber,versionCode,dateOfBirth,serviceDate\n")
+            f.write(f"P001,1234567897,AB,1980-01-01,{serviceDate}\n")
+
+        writer = BatchWriter(self.dbPath, commitSeconds=0.05)
+
+        def failingUpsert(connection, rows):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        writer.dbWriter.upsertRows = failingUpsert
+        writer.start()
+
+        app = App(inputPath, self.directory, batchWriter=writer)
+        with self.assertRaises(Exception):
+            app.run()
+
+        with self.assertRaises(Exception):
+            writer.close()
+
+        self.assertEqual(countRows(self.dbPath), 0)
+        self.assertEqual(countRows(self.dbPath, "runs"), 0)
+        self.assertEqual(countRows(self.dbPath, "run_rollups"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+from datetime import date, timedelta
+
+# Lets the tests be run from any directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from JobService import Job, JobService
+
+
+def recordsCSV():
+    """
+    :return: A CSV upload with one valid and one invalid record
+    """
+    serviceDate = (date.today() - timedelta(days=10)).isoformat()
+
+    return (
+        "patientId,healthCardNumber,versionCode,dateOfBirth,serviceDate\n"
+        f"P001,1234567897,AB,1980-01-01,{serviceDate}\n"
+        f"P002,123,AB,1980-01-01,{serviceDate}\n"
+    ).encode("utf-8")
+
+
+class JobServiceTest(unittest.TestCase):
+    """
+    Runs the job service on a free localhost port and talks to it over HTTP
+    """
+
+    def startService(self, **options):
+        workDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(workDirectory.cleanup)
+
+        service = JobService(workDirectory.name, port=0, **options)
+        service.start()
+        self.addCleanup(service.stop)
+
+        return service
+
+    def request(self, service, method, path, data=None):
+        """
+        :return: (status, body bytes)
+        """
+        request = urllib.request.Request(f"http://127.0.0.1:{service.port}{path}", data=data, method=method)
+
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def submitJob(self, service):
+        status, body = self.request(service, "POST", "/jobs?name=records.csv", recordsCSV())
+        self.assertEqual(status, 202)
+        return json.loads(body)["id"]
+
+    def waitForJob(self, service, jobId, timeout=30):
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            status, body = self.request(service, "GET", f"/jobs/{jobId}")
+            self.assertEqual(status, 200)
+
+            job = json.loads(body)
+            if job["status"] in (Job.DONE, Job.FAILED):
+                return job
+
+            time.sleep(0.05)
+
+        self.fail(f"Job {jobId} didn't finish in {timeout} seconds")
+
+    def testSubmitPollAndResults(self):
+        service = self.startService(workers=1)
+
+        jobId = self.submitJob(service)
+        job = self.waitForJob(service, jobId)
+        self.assertEqual(job["status"], Job.DONE, job["error"])
+
+        status, body = self.request(service, "GET", f"/jobs/{jobId}/statistics")
+        self.assertEqual(status, 200)
+        summary = json.loads(body)["summary"]
+        self.assertEqual(summary["validRecords"], 1)
+        self.assertEqual(summary["invalidRecords"], 1)
+
+        status, body = self.request(service, "GET", f"/jobs/{jobId}/valid")
+        self.assertEqual(status, 200)
+        self.assertIn(b"P001", body)
+        self.assertNotIn(b"P002", body)
+
+    def testUnknownJob(self):
+        service = self.startService(workers=1)
+
+        status, _ = self.request(service, "GET", "/jobs/missing")
+        self.assertEqual(status, 404)
+
+    def testFullQueueIsRejected(self):
+        # Without workers nothing leaves the queue, so the second upload finds it full
+        service = self.startService(workers=0, queueSize=1)
+
+        jobId = self.submitJob(service)
+
+        status, body = self.request(service, "POST", "/jobs?name=records.csv", recordsCSV())
+        self.assertEqual(status, 503)
+        self.assertIn("full", json.loads(body)["error"])
+
+        # Results of a job that hasn't run aren't available yet
+        status, _ = self.request(service, "GET", f"/jobs/{jobId}/statistics")
+        self.assertEqual(status, 409)
+
+    def testFinishedJobsAreEvicted(self):
+        service = self.startService(workers=1, retainJobs=1)
+
+        firstId = self.submitJob(service)
+        self.waitForJob(service, firstId)
+        firstDirectory = os.path.join(service.workDirectory, firstId)
+
+        secondId = self.submitJob(service)
+        self.waitForJob(service, secondId)
+
+        # Eviction runs on the worker right after the second job is marked done
+        deadline = time.monotonic() + 10
+        while os.path.exists(firstDirectory) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        status, _ = self.request(service, "GET", f"/jobs/{firstId}")
+        self.assertEqual(status, 404)
+        self.assertFalse(os.path.exists(firstDirectory))
+
+        status, _ = self.request(service, "GET", f"/jobs/{secondId}")
+        self.assertEqual(status, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()